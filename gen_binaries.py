@@ -0,0 +1,45 @@
+#
+# Script used to convert the pickled models into the binary format of utils/binmodel.py
+# usage: python gen_binaries.py [model directory]
+#
+# The Morphy exception lists (nouns, adjs, advs and verbs pickles) become morphy.bin and
+# tagger.pickle, when present, becomes tagger.bin. Both are picked up automatically by
+# Morphy and PerceptronTagger when found next to the pickles.
+#
+
+import os
+import pickle
+import sys
+import time
+
+from utils import binmodel
+from morphy import BINARY as MORPHY_BINARY
+from pos_tagger import PerceptronTagger, PICKLE as TAGGER_PICKLE, BINARY as TAGGER_BINARY
+
+
+def convert_morphy(base_dir):
+    sections = []
+    for name in ('nouns', 'adjs', 'advs', 'verbs'):
+        with open(os.path.join(base_dir, name + '.pickle'), 'rb') as handle:
+            table = pickle.load(handle)
+        # a few exception lines are space separated and were pickled with a None root,
+        # Morphy treats those the same as missing words so they are left out
+        table = dict((variant, root) for variant, root in table.items() if root is not None)
+        sections.extend(binmodel.mapping_sections(name, table))
+    binmodel.write(os.path.join(base_dir, MORPHY_BINARY), sections)
+
+
+def convert_tagger(base_dir):
+    tagger = PerceptronTagger(load=False)
+    tagger.load(os.path.join(base_dir, TAGGER_PICKLE))
+    tagger.save_binary(os.path.join(base_dir, TAGGER_BINARY))
+
+
+if __name__ == "__main__":
+    base_dir = sys.argv[1] if len(sys.argv) > 1 else os.path.dirname(os.path.abspath(__file__))
+    start = time.time()
+    convert_morphy(base_dir)
+    if os.path.exists(os.path.join(base_dir, TAGGER_PICKLE)):
+        convert_tagger(base_dir)
+    end = time.time()
+    print(end - start)
@@ -18,27 +18,142 @@ import pickle
 import re
 import os
 import inspect
+import threading
+import functools
 
+from utils.binmodel import BinaryModel, MappedDict
 
-class Morphy:
+BINARY = 'morphy.bin'
+
+# Exception tables shared by every Morphy instance of the process, keyed by
+# (base_dir, table name) and only loaded the first time a word of that part of
+# speech is looked up
+_TABLES = {}
+_TABLES_LOCK = threading.Lock()
+
+# morphy transforms as (suffix, replacement) rules, in the order WordNet tries them
+_ADJ_RULES = (('er', ''), ('est', ''))
+_NOUN_RULES = (('ses', 's'), ('xes', 'x'), ('zes', 'z'), ('ches', 'ch'), ('shes', 'sh'), ('men', 'man'),
+               ('ies', 'y'), ('s', ''))
+_VERB_RULES = (('ies', 'y'), ('es', ''), ('s', ''), ('ing', ''), ('ed', ''))
+
+_WORD_CHARS = re.compile(r'\w*')
+
+
+def _load_table(base_dir, name):
+    """
+    Returns the exception table name ('nouns', 'adjs', 'advs' or 'verbs') found in base_dir, loading it the first
+    time it is requested from morphy.bin if available or from its pickle otherwise
+    """
+    key = (base_dir, name)
+    table = _TABLES.get(key)
+    if table is not None:
+        return table
+    with _TABLES_LOCK:
+        table = _TABLES.get(key)
+        if table is None:
+            binary = os.path.join(base_dir, BINARY)
+            if os.path.exists(binary):
+                # words are looked up straight in the mapped file, so nothing is
+                # decoded up front and processes share its pages, see gen_binaries.py
+                table = MappedDict(BinaryModel(binary), name)
+            else:
+                with open(os.path.join(base_dir, name + '.pickle'), 'rb') as handle:
+                    table = pickle.load(handle)
+            _TABLES[key] = table
+    return table
+
+
+class _SuffixRules:
+    """
+    Precompiled morphy transforms for one part of speech.
+
+    Each rule is a re.subn of r'(suffix)\b' applied to the whole word, the first one that changes the word wins.
+    When the word is made only of word characters the only boundary a suffix can touch is the end of the word, so the
+    winning rule is found with one dict lookup per suffix length on the word's ending. Other words (hyphenated ones
+    for example) can match inside the word too and go through the compiled patterns, one after the other.
+    """
+
+    def __init__(self, rules):
+        self.endings = {}
+        for priority, (suffix, replacement) in enumerate(rules):
+            self.endings.setdefault(suffix, (priority, len(suffix), replacement))
+        self.lengths = sorted(set(len(suffix) for suffix, _ in rules))
+        self.patterns = [(re.compile(r'(%s)\b' % suffix), replacement) for suffix, replacement in rules]
+
+    def apply(self, word):
+        """
+        Applies the first matching rule to word
+        :param word: word to transform
+        :return: the transformed word, or None if no rule applies
+        """
+        if _WORD_CHARS.fullmatch(word):
+            best = None
+            for length in self.lengths:
+                rule = self.endings.get(word[-length:])
+                if rule is not None and (best is None or rule < best):
+                    best = rule
+            if best is None:
+                return None
+            return word[:len(word) - best[1]] + best[2]
+        for pattern, replacement in self.patterns:
+            new, changes = pattern.subn(replacement, word)
+            if changes > 0:
+                return new
+        return None
+
+
+_ADJ_SUFFIXES = _SuffixRules(_ADJ_RULES)
+_NOUN_SUFFIXES = _SuffixRules(_NOUN_RULES)
+_VERB_SUFFIXES = _SuffixRules(_VERB_RULES)
 
-    def __init__(self,base_dir=None):
 
+class Morphy:
+
+    def __init__(self,base_dir=None, cache_size=8192):
+        """
+        :param base_dir: directory holding the exception tables, defaults to this module's directory
+        :param cache_size: capacity of the LRU cache in front of morphy, 0 disables it
+        """
         if base_dir is None:
             base_dir = os.path.dirname(inspect.getfile(self.__class__))
-        self.nouns = {}
-        with open(os.path.join(base_dir, 'nouns.pickle'), 'rb') as handle:
-            self.nouns = pickle.load(handle)
-        self.adjs = {}
-        with open(os.path.join(base_dir, 'adjs.pickle'), 'rb') as handle:
-            self.adjs = pickle.load(handle)
-        self.advs = {}
-        with open(os.path.join(base_dir, 'advs.pickle'), 'rb') as handle:
-            self.advs = pickle.load(handle)
-        self.verbs = {}
-        with open(os.path.join(base_dir, 'verbs.pickle'), 'rb') as handle:
-            self.verbs = pickle.load(handle)
+        # exception tables are loaded lazily, see the properties below
+        self.base_dir = os.path.abspath(base_dir)
         self.modals = {"would": "will", "should":"shall", "ought":"must", "could":"can"}
+        self.cache_size = cache_size
+        if cache_size:
+            # (word, tag) pairs repeat a lot in natural text, memoize the lookups
+            self.morphy = functools.lru_cache(maxsize=cache_size)(self.morphy)
+
+    def cache_info(self):
+        """
+        cache_info returns the hit/miss counters of the morphy cache
+        :return: a functools CacheInfo tuple, None if caching is disabled
+        """
+        return self.morphy.cache_info() if self.cache_size else None
+
+    def cache_clear(self):
+        """
+        cache_clear empties the morphy cache and resets its counters
+        """
+        if self.cache_size:
+            self.morphy.cache_clear()
+
+    @property
+    def nouns(self):
+        return _load_table(self.base_dir, 'nouns')
+
+    @property
+    def adjs(self):
+        return _load_table(self.base_dir, 'adjs')
+
+    @property
+    def advs(self):
+        return _load_table(self.base_dir, 'advs')
+
+    @property
+    def verbs(self):
+        return _load_table(self.base_dir, 'verbs')
 
     #
     # morphy function based on WordNet morphy function
@@ -64,10 +179,8 @@ class Morphy:
                 if base is not None:
                     return base
                 # morphy transforms
-                new, changes = re.subn(r'(er)\b', '', word)
-                if changes > 0: return new
-                new, changes = re.subn(r'(est)\b', '', word)
-                if changes > 0: return new
+                new = _ADJ_SUFFIXES.apply(word)
+                if new is not None: return new
             elif 'RB' in pos_tag:
                 # It must be an adverb
                 base = self.advs.get(word, None)
@@ -80,37 +193,15 @@ class Morphy:
                 if base is not None:
                     return base
                 # morphy transforms for nouns
-                new, changes = re.subn(r'(ses)\b', 's', word)
-                if changes > 0: return new
-                new, changes = re.subn(r'(xes)\b', 'x', word)
-                if changes > 0: return new
-                new, changes = re.subn(r'(zes)\b', 'z', word)
-                if changes > 0: return new
-                new, changes = re.subn(r'(ches)\b', 'ch', word)
-                if changes > 0: return new
-                new, changes = re.subn(r'(shes)\b', 'sh', word)
-                if changes > 0: return new
-                new, changes = re.subn(r'(men)\b', 'man', word)
-                if changes > 0: return new
-                new, changes = re.subn(r'(ies)\b', 'y', word)
-                if changes > 0: return new
-                new, changes = re.subn(r'(s)\b', '', word)
-                if changes > 0: return new
+                new = _NOUN_SUFFIXES.apply(word)
+                if new is not None: return new
             elif 'VB' in pos_tag:
                 # It must be an verb
                 base = self.verbs.get(word, None)
                 if base is not None:
                     return base
-                new, changes = re.subn(r'(ies)\b', 'y', word)
-                if changes > 0: return new
-                new, changes = re.subn(r'(es)\b', '', word)
-                if changes > 0: return new
-                new, changes = re.subn(r'(s)\b', '', word)
-                if changes > 0: return new
-                new, changes = re.subn(r'(ing)\b', '', word)
-                if changes > 0: return new
-                new, changes = re.subn(r'(ed)\b', '', word)
-                if changes > 0: return new
+                new = _VERB_SUFFIXES.apply(word)
+                if new is not None: return new
             elif 'MD' in pos_tag:
                 base =  self.modals.get(word,None)
                 if base is not None:
@@ -8,18 +8,88 @@
 import pickle
 import os
 import inspect
+import logging
+import json
+import math
+import threading
+import zlib
+import contextlib
+
+from array import array
+
+try:
+    import fcntl
+except ImportError:
+    # no advisory file locks (windows), only the threads of a single process are kept in sync there
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# version of the pickled model layout, files without one store per class word lists
+MODEL_VERSION = 2
+# suffixes of the delta log that partial_fit and forget append to, and of the log older versions set aside while
+# compacting
+DELTA = '.delta'
+DELTA_OLD = '.delta.old'
+# suffix of the lock file serializing the delta log writers of every process
+LOCK = '.lock'
+# scoring modes, the original relative weight heuristic and a proper multinomial naive bayes
+HEURISTIC = 'heuristic'
+MULTINOMIAL = 'multinomial'
 
 
 class NaiveBayesTextClassifier:
 
-    def __init__(self, base_dir=None, load=False, file_name='default-classifier.pickle', n_grams=2, characters=False):
+    def __init__(self, base_dir=None, load=False, file_name='default-classifier.pickle', n_grams=2, characters=False,
+                 delta_limit=1000, mode=HEURISTIC, alpha=1.0, hash_buckets=None):
+        """
+        :param base_dir: directory where the model is stored, defaults to this module's directory
+        :param load: load the stored model upon instantiation
+        :param file_name: name of the model file, partial_fit and forget append to file_name + '.delta'
+        :param n_grams: size of the n-grams used as features
+        :param characters: whether the n-grams are made of characters instead of words
+        :param delta_limit: number of delta log records after which the model is compacted in the background
+        :param mode: HEURISTIC adds up 1 / corpus count of the matching n-grams, MULTINOMIAL scores with class
+            log-priors and Laplace smoothed log-likelihoods and returns probabilities
+        :param alpha: Laplace smoothing used by the MULTINOMIAL mode
+        :param hash_buckets: if set, n-grams are hashed into this many buckets and counted in fixed size integer
+            arrays instead of dicts, so memory and model file size don't grow with the vocabulary. Different n-grams
+            sharing a bucket are counted together
+        """
         self.base_dir = base_dir
         self.file_name = file_name
         if self.base_dir is None:
             self.base_dir = os.path.dirname(inspect.getfile(self.__class__))
         self.classes = []
+        # how many times each n-gram was seen in the whole corpus
         self.corpus_words = {}
-        self.class_words = {}
+        # inverted index, n-gram -> {class: times seen in that class}
+        self.index = {}
+        # with feature hashing corpus_words is an array of counts per bucket and index stays empty, the
+        # counts of each class are kept in buckets, class -> array of counts per bucket
+        self.hash_buckets = hash_buckets
+        self.buckets = {}
+        if hash_buckets:
+            self.corpus_words = self._zeros()
+        # number of training sentences of each class, for the multinomial priors
+        self.class_docs = {}
+        self.mode = mode
+        self.alpha = alpha
+        # tables derived from the counts, built on demand and dropped on any change: n-gram -> per class
+        # weights in self.classes order for classify_batch, and the multinomial log-probability tables
+        self._weights = None
+        self._log_tables = None
+        # sequence number of the last delta log record this instance has applied
+        self.seq = 0
+        # whether the counts are those of the model file, set by load and save, until then partial_fit and forget
+        # load the model file first if there is one
+        self._synced = False
+        # identity of the model file the counts were loaded from or saved to, another instance saving replaces it
+        self._snapshot = None
+        self.delta_limit = delta_limit
+        self._delta_records = 0
+        self._lock = threading.RLock()
+        self._save_lock = threading.Lock()
         self.n_grams = n_grams
         self.characters = characters
         self.connector = " "
@@ -28,17 +98,294 @@ class NaiveBayesTextClassifier:
         if load:
             self.load()
 
+    def _path(self, suffix=''):
+        return os.path.join(self.base_dir, self.file_name + suffix)
+
     def save(self):
-        with open(os.path.join(self.base_dir, self.file_name), 'wb') as handle:
-            pickle.dump({'corpus': self.corpus_words, 'class': self.class_words, 'n-grams':self.n_grams}, handle,
-                        protocol=pickle.HIGHEST_PROTOCOL)
+        """
+        save writes the whole model, which also compacts the delta log: the records it holds are part of the new
+        file and the log is started over. The counts in memory are never reloaded here: records other instances
+        appended are picked up while the model file is still the one this instance loaded or saved, otherwise the
+        counts in memory replace it. The file is written under the file lock, so savers never see each other's
+        half-written file, partial_fit and forget wait for the save to finish
+        """
+        with self._save_lock, self._lock, self._file_lock():
+            if self._synced and self._stat() == self._snapshot:
+                # pick up what other instances appended since the last load or save
+                self._replay()
+            else:
+                if self._synced:
+                    logger.warning("%s was saved by another instance since it was loaded, overwriting it",
+                                   self._path())
+                # the counts in memory replace the model file, the records logged so far are superseded
+                self.seq = max([self.seq] + [record['seq'] for record in self._records()])
+            self._synced = True
+            with open(self._path('.tmp'), 'wb') as handle:
+                pickle.dump({'version': MODEL_VERSION, 'corpus': self.corpus_words, 'index': self.index,
+                             'classes': self.classes, 'docs': self.class_docs, 'n-grams': self.n_grams,
+                             'seq': self.seq, 'hash-buckets': self.hash_buckets, 'buckets': self.buckets},
+                            handle, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(self._path('.tmp'), self._path())
+            self._snapshot = self._stat()
+            # every logged record is part of the new file now, the log of an interrupted older compaction too
+            for suffix in (DELTA, DELTA_OLD):
+                if os.path.exists(self._path(suffix)):
+                    os.remove(self._path(suffix))
+            self._delta_records = 0
+
+    def compact(self, background=False):
+        """
+        compact folds the delta log into the model file
+        :param background: run the compaction in a daemon thread
+        :return: the thread running the compaction when background is True, None otherwise
+        """
+        if not background:
+            self.save()
+            return None
+        thread = threading.Thread(target=self.save)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    @contextlib.contextmanager
+    def _file_lock(self, reading=False):
+        """
+        _file_lock holds an exclusive lock on file_name + '.lock', serializing the delta log writes and compactions of
+        every process sharing the model. It isn't reentrant, callers take it once
+        :param reading: the caller only reads the model, the lock is then skipped when there is no delta log to race
+            with or the lock file can't be created (a read-only model directory)
+        """
+        if reading and not any(os.path.exists(self._path(suffix)) for suffix in (DELTA, DELTA_OLD)):
+            yield
+            return
+        try:
+            handle = open(self._path(LOCK), 'a')
+        except OSError:
+            if not reading:
+                raise
+            yield
+            return
+        with handle:
+            if fcntl is not None:
+                fcntl.flock(handle, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(handle, fcntl.LOCK_UN)
+
+    def _records(self):
+        """
+        _records reads the delta log, the part an interrupted compaction of an older version set aside first
+        """
+        for suffix in (DELTA_OLD, DELTA):
+            if not os.path.exists(self._path(suffix)):
+                continue
+            with open(self._path(suffix)) as log:
+                for line in log:
+                    yield json.loads(line)
+
+    def _stat(self):
+        """
+        _stat identifies the current model file, None when there is none
+        """
+        try:
+            stat = os.stat(self._path())
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _sync(self):
+        """
+        _sync brings the counts up to date under the file lock: the model file is loaded again when this instance
+        never loaded it or another instance saved it since, otherwise only the new delta log records are replayed
+        """
+        if os.path.exists(self._path()) and (not self._synced or self._stat() != self._snapshot):
+            self._load()
+        else:
+            self._replay()
+        self._synced = True
+
+    def _replay(self):
+        """
+        _replay applies the delta log records with a seq above the last one applied, whoever wrote them
+        """
+        self._delta_records = 0
+        for record in self._records():
+            # records already part of the counts are skipped
+            if record['seq'] > self.seq:
+                self._learn(record['ngrams'], record['class'], 1 if record['op'] == 'add' else -1)
+                self.seq = record['seq']
+            self._delta_records += 1
 
     def load(self):
-        with open(os.path.join(self.base_dir, self.file_name), 'rb') as handle:
+        """
+        load reads the model from base_dir/file_name and replays its delta log, models saved with the old class
+        word lists layout are converted to the n-gram index on the fly, calling save afterwards migrates the file
+        """
+        with self._lock, self._file_lock(reading=True):
+            self._load()
+
+    def _load(self):
+        with open(self._path(), 'rb') as handle:
             data = pickle.load(handle)
-            self.class_words = data['class']
             self.n_grams = data['n-grams']
             self.corpus_words = data['corpus']
+            self.seq = data.get('seq', 0)
+            self.class_docs = data.get('docs', {})
+            self.hash_buckets = data.get('hash-buckets')
+            self.buckets = data.get('buckets', {})
+            if 'index' in data:
+                self.index = data['index']
+                self.classes = data['classes']
+            else:
+                self.index = {}
+                self.classes = []
+                for c, words in data['class'].items():
+                    self.classes.append(c)
+                    for w in words:
+                        class_counts = self.index.setdefault(w, {})
+                        class_counts[c] = class_counts.get(c, 0) + 1
+        self._snapshot = self._stat()
+        self._invalidate()
+        self._replay()
+        self._synced = True
+
+    def _add(self, element, class_name, count=1):
+        """
+        _add records count more occurrences of the n-gram element in class_name, a negative count removes them
+        """
+        self._invalidate()
+        if self.hash_buckets:
+            key = self._key(element)
+            self.corpus_words[key] += count
+            if class_name not in self.buckets:
+                self.buckets[class_name] = self._zeros()
+            self.buckets[class_name][key] += count
+            return
+        class_counts = self.index.setdefault(element, {})
+        class_count = class_counts.get(class_name, 0) + count
+        corpus_count = self.corpus_words.get(element, 0) + count
+        if class_count > 0:
+            class_counts[class_name] = class_count
+        else:
+            del class_counts[class_name]
+            if not class_counts:
+                del self.index[element]
+        if corpus_count > 0:
+            self.corpus_words[element] = corpus_count
+        else:
+            del self.corpus_words[element]
+
+    def _invalidate(self):
+        """
+        _invalidate drops the tables derived from the counts, they are rebuilt the next time they are needed
+        """
+        self._weights = None
+        self._log_tables = None
+
+    def _learn(self, ngrams, class_name, count):
+        """
+        _learn adds (count 1) or removes (count -1) the n-grams of a single example of class_name
+        """
+        if class_name not in self.classes:
+            self.classes.append(class_name)
+        self.class_docs[class_name] = max(self.class_docs.get(class_name, 0) + count, 0)
+        for w in ngrams:
+            # n-grams never learned for this class can't be forgotten
+            if count > 0 or class_name in self._lookup(w)[1]:
+                self._add(w, class_name, count)
+
+    def _log(self, op, X, y):
+        """
+        _log applies the examples and appends them to the delta log. Under the file lock the records other
+        instances appended are applied first, so the sequence numbers keep growing across writers
+        """
+        with self._lock, self._file_lock():
+            self._sync()
+            with open(self._path(DELTA), 'a') as log:
+                for _element, _class in zip(X, y):
+                    ngrams = self.transform_ngrams(_element)
+                    self._learn(ngrams, _class, 1 if op == 'add' else -1)
+                    self.seq += 1
+                    log.write(json.dumps({'seq': self.seq, 'op': op, 'class': _class, 'ngrams': ngrams}) + '\n')
+                    self._delta_records += 1
+            compact = self._delta_records >= self.delta_limit
+        if compact:
+            self.compact(background=True)
+
+    def partial_fit(self, X, y):
+        """
+        partial_fit updates the model in place with new examples, the changes are appended to the delta log instead
+        of rewriting the model file
+        :param X: list of tokenized sentences
+        :param y: list of the classes of those sentences
+        :return: nothing
+        """
+        self._log('add', X, y)
+
+    def forget(self, X, y):
+        """
+        forget removes previously learned examples from the model, the changes are appended to the delta log
+        :param X: list of tokenized sentences
+        :param y: list of the classes those sentences were learned as
+        :return: nothing
+        """
+        self._log('forget', X, y)
+
+    def _zeros(self):
+        return array('I', [0]) * self.hash_buckets
+
+    def _key(self, element):
+        """
+        _key gives the key the counts of the n-gram element are stored under: the n-gram itself, or its bucket when
+        using feature hashing (crc32 is used since it doesn't change between runs like hash does)
+        """
+        if self.hash_buckets:
+            return zlib.crc32(element.encode('utf-8')) % self.hash_buckets
+        return element
+
+    def _keys(self):
+        """
+        _keys lists every key with counts
+        """
+        if self.hash_buckets:
+            return [key for key, count in enumerate(self.corpus_words) if count]
+        return list(self.index)
+
+    def _counts(self, key):
+        """
+        _counts returns how many times the n-grams under key were seen in the corpus and a {class: count} dict of
+        the classes they were seen in
+        """
+        if self.hash_buckets:
+            return self.corpus_words[key], dict((c, counts[key]) for c, counts in self.buckets.items() if counts[key])
+        return self.corpus_words.get(key, 0), self.index.get(key, {})
+
+    def _lookup(self, element):
+        """
+        _lookup returns how many times element was seen in the corpus and a {class: count} dict of the classes it
+        was seen in
+        """
+        return self._counts(self._key(element))
+
+    def _reset_class(self, class_name):
+        """
+        _reset_class forgets every n-gram and sentence stored for class_name, the corpus counts are kept as they are
+        """
+        self._invalidate()
+        self.class_docs[class_name] = 0
+        if class_name not in self.classes:
+            self.classes.append(class_name)
+            return
+        if self.hash_buckets:
+            self.buckets[class_name] = self._zeros()
+            return
+        for element in list(self.index):
+            class_counts = self.index[element]
+            class_counts.pop(class_name, None)
+            if not class_counts:
+                del self.index[element]
 
     def train(self, X, y):
         """
@@ -46,24 +393,24 @@ class NaiveBayesTextClassifier:
         :param corpus: name of the tsv file containing the classes and senteces to train on
         :return: nothing but once the training is done the classes and corpus_words are defined the model stores itself
         """
-        for c in set(y):
-            # prepare a list of words within each class
-            self.class_words[c] = []
-
-        # loop through each sentence in our training data
-        for _element, _class in zip(X,y):
-            # process n-grams
-            _element = self.transform_ngrams(_element)
-            print(_element)
-            for w in _element:
-                # have we not seen this word combination already?
-                if w not in self.corpus_words:
-                    self.corpus_words[w] = 1
-                else:
-                    self.corpus_words[w] += 1
-
-                # add the word to our words in class list
-                self.class_words[_class].extend([w])
+        with self._lock:
+            for c in set(y):
+                # prepare an empty entry of each class in the index
+                self._reset_class(c)
+
+            debug = logger.isEnabledFor(logging.DEBUG)
+            # loop through each sentence in our training data
+            for _element, _class in zip(X,y):
+                # process n-grams
+                _element = self.transform_ngrams(_element)
+                if debug:
+                    logger.debug("training %s: %s", _class, _element)
+                self.class_docs[_class] += 1
+                for w in _element:
+                    # count the word combination in the corpus and in this class
+                    self._add(w, _class)
+            if self.mode == MULTINOMIAL:
+                self._log_tables = self._build_log_tables()
         self.save()
 
 
@@ -73,15 +420,125 @@ class NaiveBayesTextClassifier:
         classify here we actually calculate the probability of the sentence being part of some class, that's done by a
         simple naive analysis
         :param sentence: sentence to classify
-        :return: the highest scoring class, the score it got and a flag for trusting.
+        :return: the highest scoring class, the score it got (its probability in MULTINOMIAL mode) and a flag for
+            trusting.
+        """
+        if self.mode == MULTINOMIAL:
+            return self._pick(self._probabilities(self.transform_ngrams(sentence)))
+        # a single pass over the n-grams scores every class
+        scores = self._scores(self.transform_ngrams(sentence))
+        return self._pick([scores[c] for c in self.classes])
+
+    def predict_proba(self, sentence):
+        """
+        predict_proba gives the multinomial naive bayes probability of every class, whatever the scoring mode is
+        :param sentence: sentence to classify
+        :return: a {class: probability} dict
+        """
+        return dict(zip(self.classes, self._probabilities(self.transform_ngrams(sentence))))
+
+    def _build_log_tables(self):
+        """
+        _build_log_tables precomputes the multinomial naive bayes tables: the log-prior of every class and for each
+        n-gram its Laplace smoothed log-likelihood in every class, so scoring is only lookups and additions
+        :return: (log-priors, n-gram -> log-likelihoods, log-likelihoods of an n-gram a class never saw), all the
+            per class values in self.classes order
+        """
+        columns = dict((c, j) for j, c in enumerate(self.classes))
+        totals = [0] * len(columns)
+        keys = self._keys()
+        for key in keys:
+            for c, count in self._counts(key)[1].items():
+                totals[columns[c]] += count
+        vocabulary = len(keys) if self.hash_buckets else len(self.corpus_words)
+        denominators = [math.log(total + self.alpha * vocabulary) for total in totals]
+        unseen = tuple(math.log(self.alpha) - denominator for denominator in denominators)
+        loglik = {}
+        for key in keys:
+            row = list(unseen)
+            for c, count in self._counts(key)[1].items():
+                j = columns[c]
+                row[j] = math.log(count + self.alpha) - denominators[j]
+            loglik[key] = tuple(row)
+        docs = [self.class_docs.get(c, 0) for c in self.classes]
+        if sum(docs):
+            priors = [math.log(n) if n else float('-inf') for n in docs]
+            norm = math.log(sum(docs))
+            priors = [prior - norm for prior in priors]
+        else:
+            # models saved before sentences were counted get uniform priors
+            priors = [-math.log(len(self.classes))] * len(self.classes)
+        return priors, loglik, unseen
+
+    def _probabilities(self, ngrams):
+        """
+        _probabilities computes the multinomial naive bayes posterior of every class, n-grams out of the vocabulary
+        are ignored
+        :param ngrams: the n-grams of the sentence
+        :return: the probabilities in self.classes order
+        """
+        if not self.classes:
+            return []
+        with self._lock:
+            tables = self._log_tables
+            if tables is None:
+                tables = self._log_tables = self._build_log_tables()
+        priors, loglik, unseen = tables
+        rows = [row for row in map(loglik.get, map(self._key, ngrams)) if row is not None]
+        scores = [sum(column, prior) for prior, column in zip(priors, zip(*rows))] if rows else list(priors)
+        top = max(scores)
+        exps = [math.exp(score - top) for score in scores]
+        total = sum(exps)
+        return [e / total for e in exps]
+
+    def classify_batch(self, sentences):
+        """
+        classify_batch classifies many sentences at once. Every n-gram of the model gets a row with its weight for
+        each class (1 / corpus count when the class has seen it, 0 otherwise), the table is built once and reused
+        until the model changes. A sentence is scored by summing the rows of its n-grams column by column, which
+        gives the same results as calling classify on every sentence
+        :param sentences: list of tokenized sentences
+        :return: a list of (class, score, should_trust) tuples, one per sentence
+        """
+        if self.mode == MULTINOMIAL:
+            return [self._pick(self._probabilities(self.transform_ngrams(sentence))) for sentence in sentences]
+        with self._lock:
+            weights = self._weights
+            if weights is None:
+                weights = self._weights = self._weight_rows()
+            zero = [0] * len(self.classes)
+            results = []
+            for sentence in sentences:
+                keys = map(self._key, self.transform_ngrams(sentence))
+                rows = [row for row in map(weights.get, keys) if row is not None]
+                results.append(self._pick(list(map(sum, zip(*rows))) if rows else zero))
+            return results
+
+    def _weight_rows(self):
+        """
+        _weight_rows builds the n-gram -> per class weights table used by classify_batch
+        """
+        columns = dict((c, j) for j, c in enumerate(self.classes))
+        weights = {}
+        for key in self._keys():
+            corpus_count, class_counts = self._counts(key)
+            row = [0.0] * len(columns)
+            for c in class_counts:
+                row[columns[c]] = 1.0 / corpus_count
+            weights[key] = tuple(row)
+        return weights
+
+    def _pick(self, scores):
+        """
+        _pick chooses the highest scoring class
+        :param scores: the score of every class, in self.classes order
+        :return: the highest scoring class, the score it got and a flag for trusting, which is False on ties
         """
         high_class = None
         high_score = 0
         should_trust = True
         # loop through our classes
-        for c in self.class_words.keys():
-            # calculate score of sentence for each class
-            score = self.calculate_class_score(sentence, c, show_details=True)
+        for c, score in zip(self.classes, scores):
             # keep track of highest score
             if score == high_score:
                 should_trust = False
@@ -103,20 +560,65 @@ class NaiveBayesTextClassifier:
         """
         return words if self.n_grams == 1 else [self.connector.join(words[i:i + self.n_grams]) for i in range(len(words) - self.n_grams + 1)]
 
+    def _scores(self, ngrams):
+        """
+        _scores adds up the relative weight of every n-gram for all the classes it was seen in
+        :param ngrams: the n-grams of the sentence
+        :return: a {class: score} dict with every class
+        """
+        scores = dict((c, 0) for c in self.classes)
+        for element in ngrams:
+            corpus_count, class_counts = self._lookup(element)
+            if class_counts:
+                # treat each word with relative weight
+                weight = 1.0 / corpus_count
+                for c in class_counts:
+                    scores[c] += weight
+        return scores
+
+    def explain(self, sentence):
+        """
+        explain breaks the score of a sentence down into the contribution of each of its n-grams
+        :param sentence: sentence to explain
+        :return: a list of (n-gram, {class: contribution}) tuples in sentence order, n-grams never seen in training
+            get an empty dict. Adding up the contributions gives the scores used by classify, in MULTINOMIAL mode the
+            contributions are log-likelihoods and the class log-priors still have to be added
+        """
+        if self.mode == MULTINOMIAL:
+            with self._lock:
+                if self._log_tables is None:
+                    self._log_tables = self._build_log_tables()
+                loglik = self._log_tables[1]
+            return [(element, dict(zip(self.classes, loglik[self._key(element)])) if self._key(element) in loglik else {})
+                    for element in self.transform_ngrams(sentence)]
+        contributions = []
+        for element in self.transform_ngrams(sentence):
+            corpus_count, class_counts = self._lookup(element)
+            weight = 1.0 / corpus_count if class_counts else 0
+            contributions.append((element, dict((c, weight) for c in class_counts)))
+        return contributions
+
     # calculate a score for a given class based on how common it is
-    def calculate_class_score(self,sentence, class_name, show_details=True):
+    def calculate_class_score(self,sentence, class_name, show_details=False):
+        """
+        calculate_class_score scores the sentence for a single class
+        :param sentence: sentence to score
+        :param class_name: class to score the sentence for
+        :param show_details: log every matching n-gram and its weight at debug level
+        :return: the score of the sentence for class_name
+        """
         score = 0
-        ngrams = self.transform_ngrams(sentence)
-        print(ngrams)
-        print(self.class_words[class_name])
-        for element in ngrams:
+        for element in self.transform_ngrams(sentence):
+            corpus_count, class_counts = self._lookup(element)
             # have we not seen this word combination already?
-            if element in self.class_words[class_name]:
+            if class_name in class_counts:
                 # treat each word with relative weight
-                score += (1.0 / self.corpus_words[element])
+                score += (1.0 / corpus_count)
                 if show_details:
-                    print (" match: %s (%s)" % (element, 1.0 / self.corpus_words[element]))
+                    logger.debug(" match: %s (%s)", element, 1.0 / corpus_count)
         return score
 
     def __str__(self):
-        return "Naive bayes classifier with: \n corpus words: %s\n class words: %s\n using n_grams of: %s" % (self.corpus_words, self.class_words, self.n_grams)
\ No newline at end of file
+        if self.hash_buckets:
+            return "Naive bayes classifier with: \n %s hash buckets (%s used)\n classes: %s\n using n_grams of: %s" % (self.hash_buckets, len(self._keys()), self.classes, self.n_grams)
+        return "Naive bayes classifier with: \n corpus words: %s\n classes: %s\n index: %s\n using n_grams of: %s" % (self.corpus_words, self.classes, self.index, self.n_grams)
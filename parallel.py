@@ -0,0 +1,98 @@
+#
+# Corpus level helpers that spread tagging and lemmatization over a pool of
+# worker processes. Every worker loads its own PerceptronTagger (and Morphy
+# when lemmatizing) once, in the pool initializer, and then handles chunks of
+# lines, results come back in the same order as the input. Only a few chunks
+# per worker are read ahead, so the input is never buffered as a whole.
+#
+
+import multiprocessing
+
+from collections import deque
+from itertools import islice
+from morphy import Morphy
+from pos_tagger import PerceptronTagger
+
+# Per worker state, set up by _init_worker
+_tagger = None
+_morphy = None
+_use_tokens = True
+
+
+def _init_worker(base_dir, lemmatize, use_tokens):
+    """
+    Pool initializer, loads the models a single time for each worker process
+    """
+    global _tagger, _morphy, _use_tokens
+    _tagger = PerceptronTagger(base_dir=base_dir)
+    _morphy = Morphy(base_dir=base_dir) if lemmatize else None
+    _use_tokens = use_tokens
+
+
+def _process_chunk(lines):
+    """
+    Tags (and lemmatizes if requested) a chunk of lines inside a worker
+    """
+    tagged = _tagger.tag_batch(lines, use_tokens=_use_tokens)
+    if _morphy is None:
+        return tagged
+    return [[(word, tag, base) for (word, tag), base in zip(tokens, _morphy.change_to_base(tokens))]
+            for tokens in tagged]
+
+
+def _chunks(iterable, size):
+    """
+    Splits iterable into lists of at most size elements without reading it all first
+    """
+    iterator = iter(iterable)
+    chunk = list(islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, size))
+
+
+def itag_corpus(lines, processes=None, chunk_size=256, lemmatize=False, base_dir=None, use_tokens=True):
+    """
+    Tags every line of a corpus using a pool of worker processes, yielding the results in input order
+    :param lines: iterable of strings, each one split in sentences and tagged like PerceptronTagger.tag does
+    :param processes: number of worker processes, defaults to the number of cpus
+    :param chunk_size: number of lines sent to a worker per task, at most two chunks per worker are read from lines
+        before their results are consumed
+    :param lemmatize: if True every token also gets its Morphy base form
+    :param base_dir: directory holding the tagger and Morphy models, the default models are used if None
+    :param use_tokens: whether to use the tagger tokenize function or a plain whitespace split
+    :return: a generator of [(word, tag)] lists, or [(word, tag, base)] lists when lemmatize is True
+    """
+    processes = processes or multiprocessing.cpu_count()
+    # Load the models once here first, a worker failing to load them in the
+    # initializer is only replaced by a new one failing the same way
+    PerceptronTagger(base_dir=base_dir)
+    if lemmatize:
+        Morphy(base_dir=base_dir)
+    pool = multiprocessing.Pool(processes, initializer=_init_worker,
+                                initargs=(base_dir, lemmatize, use_tokens))
+    try:
+        # Pool.imap would read the whole input ahead of the workers, keep a
+        # bounded window of tasks in flight instead
+        pending = deque()
+        for chunk in _chunks(lines, chunk_size):
+            pending.append(pool.apply_async(_process_chunk, (chunk,)))
+            if len(pending) >= processes * 2:
+                for tokens in pending.popleft().get():
+                    yield tokens
+        while pending:
+            for tokens in pending.popleft().get():
+                yield tokens
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def tag_corpus(lines, processes=None, chunk_size=256, lemmatize=False, base_dir=None, use_tokens=True):
+    """
+    Same as itag_corpus but returns all the results in a list
+    :return: a list of [(word, tag)] lists, or [(word, tag, base)] lists when lemmatize is True
+    """
+    return list(itag_corpus(lines, processes=processes, chunk_size=chunk_size, lemmatize=lemmatize,
+                            base_dir=base_dir, use_tokens=use_tokens))
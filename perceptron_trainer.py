@@ -0,0 +1,378 @@
+#
+# Faster trainer for the PerceptronTagger. It learns the same averaged
+# perceptron as PerceptronTagger.train, but every feature string gets an
+# integer id the first time it is updated and the weights, totals and
+# timestamps live in flat arrays (one row of len(classes) values per feature)
+# instead of dicts keyed by (feature, class) tuples.
+#
+# Training can optionally be spread over several processes with iterative
+# parameter mixing: every epoch the shuffled sentences are split in shards,
+# each worker runs one perceptron epoch over its shard starting from the
+# current weights and the resulting weights are averaged back together.
+#
+# Every epoch logs (and keeps in PerceptronTrainer.stats) the number of
+# tokens, the tokens per second and the training accuracy.
+#
+# train_cached trains from a treebank.FeatureCache instead, only the four
+# features depending on the previous tags are built while training, the
+# static ones go straight from their cache ids to weight rows.
+#
+
+import logging
+import multiprocessing
+import operator
+import pickle
+import random
+import time
+
+from array import array
+from itertools import repeat
+from pos_tagger import PerceptronTagger
+from treebank import FeatureCache
+
+
+class _Weights(object):
+
+    '''Averaged perceptron weights stored as flat arrays indexed by feature id.'''
+
+    def __init__(self, labels, features=(), weights=None):
+        self.labels = labels
+        self.width = len(labels)
+        self.columns = dict((label, j) for j, label in enumerate(labels))
+        self.features = list(features)
+        self.feat_ids = dict((feat, f) for f, feat in enumerate(self.features))
+        size = len(self.features) * self.width
+        self.weights = array('d', weights) if weights is not None else array('d', [0.0]) * size
+        # The accumulated values and the last time each weight was changed,
+        # for the averaging
+        self.totals = array('d', [0.0]) * size
+        self.tstamps = array('l', [0]) * size
+        # Number of instances seen
+        self.i = 0
+
+    def _feat_id(self, feat):
+        '''Return the id of feat, giving it a new zeroed row if it has none yet.'''
+        f = self.feat_ids.get(feat)
+        if f is None:
+            f = self.feat_ids[feat] = len(self.features)
+            self.features.append(feat)
+            self.weights.extend(array('d', [0.0]) * self.width)
+            self.totals.extend(array('d', [0.0]) * self.width)
+            self.tstamps.extend(array('l', [0]) * self.width)
+        return f
+
+    def predict(self, features):
+        '''Return the best label for an iterable of feature strings.'''
+        feat_ids = self.feat_ids
+        return self.predict_ids([feat_ids.get(feat, -1) for feat in features])
+
+    def predict_ids(self, ids):
+        '''``predict`` for feature ids, -1 standing for a feature without a row.'''
+        weights = self.weights
+        width = self.width
+        rows = []
+        for f in ids:
+            if f >= 0:
+                start = f * width
+                rows.append(weights[start:start + width])
+        if not rows:
+            rows.append([0.0] * width)
+        # Same (score, label) tie-break as AveragedPerceptron.predict
+        return max(zip(map(sum, zip(*rows)), self.labels))[1]
+
+    def update(self, truth, guess, features):
+        '''Update the weights of the truth and guess columns for every feature.'''
+        if truth == guess:
+            return self.update_ids(truth, guess, ())
+        return self.update_ids(truth, guess, [self._feat_id(feat) for feat in features])
+
+    def update_ids(self, truth, guess, ids):
+        '''``update`` for feature ids, every feature must have its row already.'''
+        self.i += 1
+        if truth == guess:
+            return None
+        weights = self.weights
+        totals = self.totals
+        tstamps = self.tstamps
+        i = self.i
+        width = self.width
+        t = self.columns[truth]
+        g = self.columns[guess]
+        for f in ids:
+            start = f * width
+            for k, v in ((start + t, 1.0), (start + g, -1.0)):
+                totals[k] += (i - tstamps[k]) * weights[k]
+                tstamps[k] = i
+                weights[k] += v
+        return None
+
+    def averaged_array(self):
+        '''Return the averaged weights, rounded like average_weights, as a flat array.'''
+        i = self.i
+        totals = map(operator.add, self.totals,
+                     map(operator.mul, map(operator.sub, repeat(i), self.tstamps), self.weights))
+        return array('d', map(round, map(operator.truediv, totals, repeat(float(i))), repeat(3)))
+
+    def averaged(self):
+        '''Return the averaged weights as the dict-of-dicts AveragedPerceptron uses.'''
+        if not self.i:
+            return {}
+        return _weights_dict(self.labels, self.features, self.averaged_array())
+
+
+def _weights_dict(labels, features, values):
+    '''The dict-of-dicts of a flat weights array, leaving the zero weights out.'''
+    width = len(labels)
+    weights = {}
+    for f, feat in enumerate(features):
+        start = f * width
+        weights[feat] = dict((label, value) for label, value in zip(labels, values[start:start + width]) if value)
+    return weights
+
+
+def _run_epoch(tagger, model, sentences):
+    '''One perceptron pass over sentences, returns (correct, total) token counts.'''
+    c = 0
+    n = 0
+    start = tagger.START
+    end = tagger.END
+    tagdict = tagger.tagdict
+    for words, tags in sentences:
+        prev, prev2 = start
+        context = start + [tagger._normalize(w) for w in words] + end
+        for i, word in enumerate(words):
+            guess = tagdict.get(word)
+            if not guess:
+                feats = tagger._get_features(i, word, context, prev, prev2)
+                guess = model.predict(feats)
+                model.update(tags[i], guess, feats)
+            prev2 = prev
+            prev = guess
+            c += guess == tags[i]
+            n += 1
+    return c, n
+
+
+def _cache_rows(model, cache):
+    '''The row of every feature of a FeatureCache in model, -1 for the ones without one yet.'''
+    feat_ids = model.feat_ids
+    return array('l', [feat_ids.get(feat, -1) for feat in cache.features])
+
+
+def _run_cached_epoch(tagger, model, cache, rows, sentence_ids):
+    '''``_run_epoch`` over the sentences of a FeatureCache.
+
+    rows maps the static feature ids of the cache to rows of model (see
+    ``_cache_rows``) and is kept up to date as features get a row, only the
+    four tag features are looked up by string.
+    '''
+    c = 0
+    n = 0
+    tagdict = tagger.tagdict
+    feat_ids = model.feat_ids
+    features = cache.features
+    for s in sentence_ids:
+        words, tags, norms, static = cache.token_ids(s)
+        prev, prev2 = tagger.START
+        for i, word in enumerate(words):
+            guess = tagdict.get(word)
+            if not guess:
+                tag_feats = ['i-1 tag ' + prev, 'i-2 tag ' + prev2, 'i tag+i-2 tag ' + prev + ' ' + prev2,
+                             'i-1 tag+i word ' + prev + ' ' + norms[i]]
+                ids = [rows[f] for f in static[i]] + [feat_ids.get(feat, -1) for feat in tag_feats]
+                guess = model.predict_ids(ids)
+                if guess != tags[i]:
+                    # Give the features without a row one, in the order _run_epoch does
+                    for k, f in enumerate(static[i]):
+                        if ids[k] < 0:
+                            ids[k] = rows[f] = model._feat_id(features[f])
+                    for k, feat in enumerate(tag_feats, len(static[i])):
+                        if ids[k] < 0:
+                            ids[k] = model._feat_id(feat)
+                model.update_ids(tags[i], guess, ids)
+            prev2 = prev
+            prev = guess
+            c += guess == tags[i]
+            n += 1
+    return c, n
+
+
+def _run(tagger, model, items, cache, rows=None):
+    if cache is None:
+        return _run_epoch(tagger, model, items)
+    if rows is None:
+        rows = _cache_rows(model, cache)
+    return _run_cached_epoch(tagger, model, cache, rows, items)
+
+
+# Per worker state of iterative parameter mixing, set up by _init_shard_worker
+_shard_tagger = None
+_shard_labels = None
+_shard_cache = None
+
+
+def _init_shard_worker(labels, tagdict, cache_path):
+    '''Pool initializer, the labels, tag dictionary and FeatureCache don't
+    change between epochs, so they are sent and opened once per worker.
+    '''
+    global _shard_tagger, _shard_labels, _shard_cache
+    _shard_tagger = PerceptronTagger(load=False)
+    _shard_tagger.tagdict = tagdict
+    _shard_labels = labels
+    _shard_cache = FeatureCache(cache_path) if cache_path is not None else None
+
+
+def _train_shard(args):
+    '''Pool task of iterative parameter mixing, one epoch over a shard.
+
+    The starting features and weights come pickled once per epoch. Returns
+    the features added by the shard, the final weights and, on the last
+    epoch only, the averaged weights, plus the (correct, total) counts.
+    '''
+    model_data, shard, last = args
+    features, weights = pickle.loads(model_data)
+    model = _Weights(_shard_labels, features, weights)
+    c, n = _run(_shard_tagger, model, shard, _shard_cache)
+    averaged = model.averaged_array() if last else None
+    return model.features[len(features):], model.weights, averaged, c, n
+
+
+class PerceptronTrainer(object):
+
+    '''Trains the weights of a PerceptronTagger.
+
+    :param tagger: The PerceptronTagger to train, a new empty one if ``None``.
+    :param nr_iter: Number of training epochs.
+    :param processes: Number of worker processes, more than one enables
+        iterative parameter mixing.
+    :param freq_thresh: Tag dictionary threshold, see ``PerceptronTagger._make_tagdict``.
+    :param ambiguity_thresh: Tag dictionary threshold, see ``PerceptronTagger._make_tagdict``.
+    '''
+
+    def __init__(self, tagger=None, nr_iter=5, processes=1, freq_thresh=20, ambiguity_thresh=0.97):
+        self.tagger = tagger if tagger is not None else PerceptronTagger(load=False)
+        self.nr_iter = nr_iter
+        self.processes = processes
+        self.freq_thresh = freq_thresh
+        self.ambiguity_thresh = ambiguity_thresh
+        # One dict per epoch with its tokens, seconds, tokens_per_sec and accuracy
+        self.stats = []
+
+    def train(self, sentences, save_loc=None):
+        '''Train the tagger from sentences and freeze its model.
+
+        :param sentences: A list of (words, tags) tuples, it is not modified.
+        :param save_loc: If not ``None``, saves a pickled model in this location,
+            in the same format as ``PerceptronTagger.train``.
+        :return: the trained tagger
+        '''
+        sentences = list(sentences)
+        self.tagger._make_tagdict(sentences, freq_thresh=self.freq_thresh, ambiguity_thresh=self.ambiguity_thresh)
+        return self._train(sentences, None, save_loc)
+
+    def train_cached(self, cache, sentence_ids=None, save_loc=None):
+        '''Train the tagger from a ``treebank.FeatureCache`` and freeze its model.
+        Given the same sentences and random state it learns the same weights
+        as ``train``.
+
+        :param cache: The FeatureCache holding the training corpus.
+        :param sentence_ids: Indexes of the cached sentences to train on, all of
+            them if ``None``.
+        :param save_loc: If not ``None``, saves a pickled model in this location.
+        :return: the trained tagger
+        '''
+        sentence_ids = list(range(len(cache)) if sentence_ids is None else sentence_ids)
+        self.tagger._make_tagdict((cache.sentence(s) for s in sentence_ids), freq_thresh=self.freq_thresh,
+                                  ambiguity_thresh=self.ambiguity_thresh)
+        return self._train(sentence_ids, cache, save_loc)
+
+    def _train(self, items, cache, save_loc):
+        tagger = self.tagger
+        labels = sorted(tagger.classes)
+        self.stats = []
+        if self.processes > 1:
+            weights = self._train_mixed(labels, items, cache)
+        else:
+            model = _Weights(labels)
+            # The cache rows of model are kept up to date from epoch to epoch
+            rows = _cache_rows(model, cache) if cache is not None else None
+            for iter_ in range(self.nr_iter):
+                started = time.time()
+                c, n = _run(tagger, model, items, cache, rows)
+                random.shuffle(items)
+                self._report(iter_, c, n, time.time() - started)
+            weights = model.averaged()
+        tagger.model.weights = weights
+        tagger.model.classes = tagger.classes
+        tagger.model.freeze()
+        if save_loc is not None:
+            with open(save_loc, 'wb') as handle:
+                pickle.dump((tagger.model.weights, tagger.tagdict, tagger.classes), handle, -1)
+        return tagger
+
+    def _train_mixed(self, labels, items, cache):
+        '''Iterative parameter mixing, returns the averaged weights dict.
+
+        The weights of every epoch start from the mix of the previous one, the
+        final model is the mix of the averaged weights of the last epoch, the
+        only ones that get averaged.
+        '''
+        features = []
+        weights = array('d')
+        averaged = {}
+        cache_path = cache.path if cache is not None else None
+        pool = multiprocessing.Pool(self.processes, initializer=_init_shard_worker,
+                                    initargs=(labels, self.tagger.tagdict, cache_path))
+        try:
+            for iter_ in range(self.nr_iter):
+                started = time.time()
+                last = iter_ == self.nr_iter - 1
+                shards = [items[k::self.processes] for k in range(self.processes)]
+                model_data = pickle.dumps((features, weights), -1)
+                results = pool.map(_train_shard, [(model_data, shard, last) for shard in shards if shard])
+                mixed_features, weights = self._mix(labels, features, [(new_features, shard_weights)
+                                                                       for new_features, shard_weights, _, _, _ in
+                                                                       results])
+                if last:
+                    _, mixed = self._mix(labels, features, [(new_features, shard_averaged)
+                                                            for new_features, _, shard_averaged, _, _ in results])
+                    averaged = _weights_dict(labels, mixed_features, array('d', map(round, mixed, repeat(3))))
+                features = mixed_features
+                c = sum(result[3] for result in results)
+                n = sum(result[4] for result in results)
+                random.shuffle(items)
+                self._report(iter_, c, n, time.time() - started)
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+        return averaged
+
+    @staticmethod
+    def _mix(labels, features, results):
+        '''Average the weights arrays of the workers.
+
+        Every worker started from the same features, so their rows line up
+        and are added array-wise. The rows of the (new features, weights)
+        each worker added after them are merged by feature string.
+        '''
+        width = len(labels)
+        size = len(features) * width
+        mixed = _Weights(labels, features, results[0][1][:size])
+        for _, weights in results[1:]:
+            mixed.weights = array('d', map(operator.add, mixed.weights, weights[:size]))
+        for new_features, weights in results:
+            for f, feat in enumerate(new_features, len(features)):
+                start = mixed._feat_id(feat) * width
+                mixed.weights[start:start + width] = array('d', map(
+                    operator.add, mixed.weights[start:start + width], weights[f * width:(f + 1) * width]))
+        return mixed.features, array('d', map(operator.truediv, mixed.weights, repeat(float(len(results)))))
+
+    def _report(self, iter_, c, n, seconds):
+        stats = {'epoch': iter_, 'tokens': n, 'seconds': seconds,
+                 'tokens_per_sec': n / seconds if seconds else float('inf'),
+                 'accuracy': float(c) / n if n else 0.0}
+        self.stats.append(stats)
+        logging.info("Iter {0}: {1}/{2}={3:.3f} {4:.0f} tokens/sec".format(
+            iter_, c, n, stats['accuracy'] * 100, stats['tokens_per_sec']))
+        return None
@@ -0,0 +1,80 @@
+#
+# Streaming file to file tagging pipeline. Input files are read line by line,
+# tagged in small batches and written out straight away in the same
+# word|TAG format used by the penn_treebank file, so memory use does not
+# depend on the size of the input.
+#
+
+import csv
+import io
+
+from itertools import islice
+
+
+def read_lines(path, column=None, encoding='utf-8'):
+    """
+    Lazily reads the sentences of a text or tsv file
+    :param path: path of the file to read
+    :param column: for tsv files the name of the column holding the sentences, if None every line is a sentence
+    :param encoding: encoding of the file
+    :return: a generator of sentences
+    """
+    with io.open(path, encoding=encoding, newline='' if column is not None else None) as handle:
+        if column is None:
+            for line in handle:
+                yield line.rstrip('\r\n')
+        else:
+            for row in csv.DictReader(handle, dialect='excel-tab'):
+                yield row[column]
+
+
+def tag_lines(lines, tagger, morphy=None, use_tokens=True, batch_size=64):
+    """
+    Tags an iterable of sentences, only batch_size sentences are held in memory at any time
+    :param lines: iterable of sentences
+    :param tagger: PerceptronTagger used to tag the sentences
+    :param morphy: optional Morphy, when given each word is changed to its base form
+    :param use_tokens: whether to use the tagger tokenize function or a plain whitespace split
+    :param batch_size: number of sentences sent to PerceptronTagger.tag_batch at once
+    :return: a generator of [(word, tag)] lists, one per sentence
+    """
+    lines = iter(lines)
+    batch = list(islice(lines, batch_size))
+    while batch:
+        for tokens in tagger.tag_batch(batch, use_tokens=use_tokens):
+            if morphy is not None:
+                tokens = list(zip(morphy.change_to_base(tokens), [tag for _, tag in tokens]))
+            yield tokens
+        batch = list(islice(lines, batch_size))
+
+
+def format_tagged(tokens):
+    """
+    Formats a tagged sentence the same way as the penn_treebank file
+    :param tokens: list of (word, tag) tuples
+    :return: the sentence as word|TAG pairs separated by spaces
+    """
+    return ''.join('%s|%s ' % (word, tag) for word, tag in tokens)
+
+
+def tag_file(in_path, out_path, tagger, morphy=None, column=None, use_tokens=True, batch_size=64,
+             encoding='utf-8'):
+    """
+    Tags every sentence of in_path and writes them to out_path, one tagged sentence per line
+    :param in_path: text or tsv file to tag
+    :param out_path: file where the word|TAG lines are written
+    :param tagger: PerceptronTagger used to tag the sentences
+    :param morphy: optional Morphy, when given each word is written in its base form
+    :param column: for tsv files the name of the column holding the sentences
+    :param use_tokens: whether to use the tagger tokenize function or a plain whitespace split
+    :param batch_size: number of sentences tagged at once
+    :param encoding: encoding used for both files
+    :return: the number of sentences written
+    """
+    count = 0
+    with io.open(out_path, 'w', encoding=encoding) as out:
+        for tokens in tag_lines(read_lines(in_path, column=column, encoding=encoding), tagger,
+                                morphy=morphy, use_tokens=use_tokens, batch_size=batch_size):
+            out.write(format_tagged(tokens) + '\n')
+            count += 1
+    return count
@@ -14,7 +14,13 @@ import pickle
 import os
 import random
 import logging
+import functools
+import heapq
+import math
+import operator
 
+from array import array
+from utils import binmodel
 from utils import string_utils
 from collections import defaultdict
 
@@ -40,9 +46,128 @@ class AveragedPerceptron(object):
         self._tstamps = defaultdict(int)
         # Number of instances seen
         self.i = 0
+        # Compiled inference tables, see ``freeze``
+        self._feat_ids = None
+        self._labels = None
+        self._matrix = None
+        # Per class scale of a quantized matrix, see ``compress``
+        self._scales = None
+
+    @property
+    def frozen(self):
+        '''Whether ``predict`` uses the compiled score matrix.'''
+        return self._matrix is not None
+
+    def freeze(self):
+        '''Compile the weights into an integer-indexed score matrix.
+
+        Every feature string gets a row id and every class a column (classes
+        sorted alphabetically, matching the tie-break of ``predict``). The rows
+        are stored back to back in a flat ``array('d')``, so a prediction is a
+        dict lookup per feature plus a column-wise row sum. The dict-of-dicts
+        weights are kept, and any later ``update`` thaws the model again.
+        '''
+        labels = sorted(self.classes.union(*self.weights.values()))
+        columns = dict((label, j) for j, label in enumerate(labels))
+        feat_ids = {}
+        matrix = array('d')
+        for feat, weights in self.weights.items():
+            row = [0.0] * len(labels)
+            for label, weight in weights.items():
+                row[columns[label]] = weight
+            feat_ids[feat] = len(feat_ids)
+            matrix.extend(row)
+        self._feat_ids = feat_ids
+        self._labels = labels
+        self._matrix = matrix
+        self._scales = None
+        return None
+
+    def thaw(self):
+        '''Drop the compiled score matrix and go back to the dict weights.'''
+        self._feat_ids = None
+        self._labels = None
+        self._matrix = None
+        self._scales = None
+        return None
+
+    @property
+    def scales(self):
+        '''Per class scale of a quantized matrix, ``None`` if it holds floats.'''
+        return self._scales
+
+    def compress(self, threshold=0.0, counts=None, min_count=1, bits=8):
+        '''Prune and quantize the compiled score matrix.
+
+        Weights whose absolute value is below ``threshold`` are zeroed, then
+        features firing fewer than ``min_count`` times according to ``counts``
+        (a {feature: count} dict, see ``PerceptronTagger.feature_counts``) or
+        left without weights are dropped. The remaining weights are stored as
+        int8 (``bits=8``) or int16 (``bits=16``) fixed-point values with one
+        scale per class. The dict weights and averaging state are released,
+        so like a binary model the compressed model can only predict.
+        '''
+        typecode = {8: 'b', 16: 'h'}.get(bits)
+        if typecode is None:
+            raise ValueError("bits must be 8 or 16")
+        if self._matrix is None:
+            self.freeze()
+        width = len(self._labels)
+        matrix = self._matrix
+        old_scales = self._scales
+        kept = []
+        for feat, row_id in self._feat_ids.items():
+            if counts is not None and counts.get(feat, 0) < min_count:
+                continue
+            row = matrix[row_id * width:(row_id + 1) * width]
+            if old_scales is not None:
+                row = [weight * scale for weight, scale in zip(row, old_scales)]
+            row = [weight if abs(weight) >= threshold else 0.0 for weight in row]
+            if any(row):
+                kept.append((feat, row))
+        limit = (1 << (bits - 1)) - 1
+        scales = [max([abs(row[j]) for _, row in kept] or [0.0]) / limit or 1.0 for j in range(width)]
+        feat_ids = {}
+        quantized = array(typecode)
+        for feat, row in kept:
+            row = [int(round(weight / scale)) for weight, scale in zip(row, scales)]
+            # weights much smaller than the largest of their class round to zero
+            if any(row):
+                feat_ids[feat] = len(feat_ids)
+                quantized.extend(row)
+        self._feat_ids = feat_ids
+        self._matrix = quantized
+        self._scales = scales
+        self.weights = {}
+        self._totals = defaultdict(int)
+        self._tstamps = defaultdict(int)
+        return None
+
+    def dump_frozen(self):
+        '''Return the compiled tables as (features, labels, matrix), features
+        listed in row order. Freezes the model first if needed.
+        '''
+        if self._matrix is None:
+            self.freeze()
+        return list(self._feat_ids), list(self._labels), self._matrix
+
+    def load_frozen(self, features, labels, matrix, scales=None):
+        '''Install compiled tables produced by ``dump_frozen``. ``matrix`` may be
+        any flat buffer of floats, e.g. a memoryview over a mapped file, or of
+        integers along with their per class ``scales`` (see ``compress``). The
+        dict weights are not rebuilt, so such a model is for inference only.
+        '''
+        self._feat_ids = dict(zip(features, range(len(features))))
+        self._labels = list(labels)
+        self._matrix = matrix
+        self._scales = list(scales) if scales is not None else None
+        self.classes = set(labels)
+        return None
 
     def predict(self, features):
         '''Dot-product the features and current weights and return the best label.'''
+        if self._matrix is not None:
+            return self._predict_frozen(features)
         scores = defaultdict(float)
         for feat, value in features.items():
             if feat not in self.weights or value == 0:
@@ -53,6 +178,70 @@ class AveragedPerceptron(object):
         # Do a secondary alphabetic sort, for stability
         return max(self.classes, key=lambda label: (scores[label], label))
 
+    def _predict_frozen(self, features):
+        '''``predict`` over the compiled matrix, gives the same labels as the dict path.'''
+        feat_ids = self._feat_ids
+        matrix = self._matrix
+        width = len(self._labels)
+        rows = []
+        for feat, value in features.items():
+            row_id = feat_ids.get(feat)
+            if row_id is None or value == 0:
+                continue
+            start = row_id * width
+            row = matrix[start:start + width]
+            rows.append(row if value == 1 else [value * weight for weight in row])
+        if not rows:
+            rows.append([0.0] * width)
+        # Column sums are added in feature order, just like the dict path, and
+        # the (score, label) tuples keep the secondary alphabetic sort
+        scores = map(sum, zip(*rows))
+        if self._scales is not None:
+            scores = map(operator.mul, scores, self._scales)
+        return max(zip(scores, self._labels))[1]
+
+    @property
+    def feature_ids(self):
+        '''The {feature: row id} dict of the compiled matrix, freezes the model if needed.'''
+        if self._matrix is None:
+            self.freeze()
+        return self._feat_ids
+
+    def predict_rows(self, row_ids):
+        '''``predict`` for features given as row ids of the compiled matrix
+        (see ``feature_ids``), all of them with value 1.
+        '''
+        matrix = self._matrix
+        width = len(self._labels)
+        rows = [matrix[row_id * width:(row_id + 1) * width] for row_id in row_ids]
+        if not rows:
+            rows.append([0.0] * width)
+        scores = map(sum, zip(*rows))
+        if self._scales is not None:
+            scores = map(operator.mul, scores, self._scales)
+        return max(zip(scores, self._labels))[1]
+
+    def scores_rows(self, row_ids):
+        '''Score of every class, in ``labels`` order, for features given as row
+        ids of the compiled matrix.
+        '''
+        matrix = self._matrix
+        width = len(self._labels)
+        rows = [matrix[row_id * width:(row_id + 1) * width] for row_id in row_ids]
+        if not rows:
+            rows.append([0.0] * width)
+        scores = map(sum, zip(*rows))
+        if self._scales is not None:
+            scores = map(operator.mul, scores, self._scales)
+        return list(scores)
+
+    @property
+    def labels(self):
+        '''Classes of the compiled matrix, in column order.'''
+        if self._matrix is None:
+            self.freeze()
+        return self._labels
+
     def update(self, truth, guess, features):
         '''Update the feature weights.'''
         def upd_feat(c, f, w, v):
@@ -61,6 +250,8 @@ class AveragedPerceptron(object):
             self._tstamps[param] = self.i
             self.weights[f][c] = w + v
 
+        if self._matrix is not None:
+            self.thaw()
         self.i += 1
         if truth == guess:
             return None
@@ -99,18 +290,118 @@ def train(nr_iter, examples):
     ``nr_iter`` iterations.
     '''
     model = AveragedPerceptron()
+    model.classes = set(class_ for _, class_ in examples)
     for i in range(nr_iter):
         random.shuffle(examples)
         for features, class_ in examples:
-            scores = model.predict(features)
-            guess, score = max(scores.items(), key=lambda i: i[1])
-            if guess != class_:
-                model.update(class_, guess, features)
+            guess = model.predict(features)
+            # update counts every instance for the averaging, right guesses included
+            model.update(class_, guess, features)
     model.average_weights()
+    model.freeze()
     return model
 
 
 PICKLE = "tagger.pickle"
+BINARY = "tagger.bin"
+
+# Templates of the features built by PerceptronTagger._get_features, in the
+# order they are added. The two pair templates take two space separated values
+TEMPLATES = ('bias', 'i suffix', 'i pref1', 'i-1 tag', 'i-2 tag', 'i tag+i-2 tag', 'i word', 'i-1 tag+i word',
+             'i-1 word', 'i-1 suffix', 'i-2 word', 'i+1 word', 'i+1 suffix', 'i+2 word')
+PAIR_TEMPLATES = ('i tag+i-2 tag', 'i-1 tag+i word')
+
+
+class _FeatureTables(object):
+
+    '''Row ids of the features of a compiled model, split by template.
+
+    The feature strings are parsed back into their template and values, so
+    any string keyed model (pickled, binary or compressed) can be scored
+    straight from the words and tags: one dict lookup per template and no
+    feature string built. Pair templates are nested dicts, first value then
+    second value.
+    '''
+
+    def __init__(self, feat_ids):
+        self.feat_ids = feat_ids
+        self.bias = None
+        self.tables = dict((name, {}) for name in TEMPLATES[1:])
+        prefixes = [(name + ' ', name in PAIR_TEMPLATES, self.tables[name]) for name in TEMPLATES[1:]]
+        for feat, row_id in feat_ids.items():
+            if feat == 'bias':
+                self.bias = row_id
+                continue
+            for prefix, pair, table in prefixes:
+                if feat.startswith(prefix):
+                    value = feat[len(prefix):]
+                    if pair:
+                        first, _, second = value.partition(' ')
+                        table.setdefault(first, {})[second] = row_id
+                    else:
+                        table[value] = row_id
+                    break
+        # the tag templates, looked up for every prediction
+        self.prev_tag = self.tables['i-1 tag']
+        self.prev2_tag = self.tables['i-2 tag']
+        self.tag_pair = self.tables['i tag+i-2 tag']
+        self.tag_word = self.tables['i-1 tag+i word']
+
+
+class _SentenceBuffer(object):
+
+    '''Per sentence store of the static feature rows.
+
+    Every decode call makes its own buffer, only the ``_FeatureTables`` it
+    reads from are shared, so one tagger can be used from several threads.
+    The row ids of the features that don't depend on the predicted tags are
+    looked up once per position, the first time ``rows`` needs them, so words
+    resolved by the tag dictionary cost nothing. ``rows`` adds the four tag
+    features and returns the ids in the same order as ``_get_features``, so
+    the scores add up exactly like the feature dict path.
+    '''
+
+    def __init__(self, tables, words, context):
+        '''``context`` being the normalized words wrapped in START and END.'''
+        self.tables = tables
+        self.words = words
+        self.context = context
+        self.static = [None] * len(words)
+
+    def _static(self, i):
+        '''Look up the static rows of position ``i``.'''
+        tables = self.tables.tables
+        word = self.words[i]
+        context = self.context
+        j = i + 2
+        head = [row_id for row_id in (self.tables.bias, tables['i suffix'].get(word[-3:]),
+                                      tables['i pref1'].get(word[0])) if row_id is not None]
+        tail = [row_id for row_id in (tables['i-1 word'].get(context[j - 1]),
+                                      tables['i-1 suffix'].get(context[j - 1][-3:]),
+                                      tables['i-2 word'].get(context[j - 2]), tables['i+1 word'].get(context[j + 1]),
+                                      tables['i+1 suffix'].get(context[j + 1][-3:]),
+                                      tables['i+2 word'].get(context[j + 2])) if row_id is not None]
+        entry = self.static[i] = (head, tables['i word'].get(context[j]), tail, context[j])
+        return entry
+
+    def rows(self, i, prev, prev2):
+        '''Row ids of all the features of position ``i`` given the previous two tags.'''
+        tables = self.tables
+        head, current, tail, norm = self.static[i] or self._static(i)
+        row_ids = list(head)
+        for row_id in (tables.prev_tag.get(prev), tables.prev2_tag.get(prev2)):
+            if row_id is not None:
+                row_ids.append(row_id)
+        pairs = tables.tag_pair.get(prev)
+        if pairs is not None and prev2 in pairs:
+            row_ids.append(pairs[prev2])
+        if current is not None:
+            row_ids.append(current)
+        pairs = tables.tag_word.get(prev)
+        if pairs is not None and norm in pairs:
+            row_ids.append(pairs[norm])
+        row_ids.extend(tail)
+        return row_ids
 
 
 def tokenize( text, include_punc=False):
@@ -138,51 +429,248 @@ class PerceptronTagger():
     See more implementation details here:
         http://honnibal.wordpress.com/2013/09/11/a-good-part-of-speechpos-tagger-in-about-200-lines-of-python/
 
-    :param load: Load the pickled model upon instantiation.
+    :param load: Load the model upon instantiation, the binary ``tagger.bin``
+        is used when present and the pickled model otherwise.
+    :param cache_size: Capacity of the LRU caches in front of the per-word
+        normalization and feature string work, ``0`` disables them.
     '''
 
     START = ['-START-', '-START2-']
     END = ['-END-', '-END2-']
     AP_MODEL_LOC = os.path.join(os.path.dirname(__file__), PICKLE)
 
-    def __init__(self, load=True, base_dir=None):
+    def __init__(self, load=True, base_dir=None, cache_size=8192):
         self.model = AveragedPerceptron()
         self.tagdict = {}
         self.classes = set()
+        self.cache_size = cache_size
+        # Template tables of the compiled model, see ``_buffer``
+        self._feature_tables = None
+        # Tagged tokens, the ones resolved by the tag dictionary and the
+        # normalized words, see ``fast_path_stats``
+        self._stats = {'tokens': 0, 'fast_path': 0, 'normalized': 0}
+        if cache_size:
+            # The same words come up again and again, so memoize the string
+            # work done per word, see ``cache_info``
+            cache = functools.lru_cache(maxsize=cache_size)
+            self._normalize = cache(self._normalize)
+            self._word_features = cache(self._word_features)
+            self._context_features = cache(self._context_features)
         if load:
-            self.load(self.AP_MODEL_LOC if base_dir is None else os.path.join(base_dir, PICKLE))
-
-    def tag(self, corpus, use_tokens=True):
-        '''Tags a string `corpus`.'''
-        # Assume untokenized corpus has \n between sentences and ' ' between words
+            model_dir = os.path.dirname(self.AP_MODEL_LOC) if base_dir is None else base_dir
+            if os.path.exists(os.path.join(model_dir, BINARY)):
+                self.load_binary(os.path.join(model_dir, BINARY))
+            else:
+                self.load(os.path.join(model_dir, PICKLE))
+
+    def tag(self, corpus, use_tokens=True, beam_width=1):
+        '''Tags a string `corpus`.
+
+        The corpus is split in sentences with ``string_utils.split_sentences``
+        (line breaks and sentence final punctuation, abbreviations aside)
+        before tokenizing, and every sentence is tagged on its own, starting
+        from the START context.
+
+        :param beam_width: Number of hypotheses kept by the decoder, 1 is the
+            plain greedy tagger, wider beams are slower but can recover from
+            an early wrong tag.
+        '''
         w_split = tokenize if use_tokens else lambda s: s.split()
 
         def split_sents(corpus):
-            yield w_split(corpus)
+            # tokenize strips the punctuation the segmenter relies on, so split first
+            for sentence in string_utils.split_sentences(corpus):
+                yield w_split(sentence)
 
-        prev, prev2 = self.START
         tokens = []
         for words in split_sents(corpus):
-            context = self.START + [self._normalize(w) for w in words] + self.END
-            for i, word in enumerate(words):
-                tag = self.tagdict.get(word)
-                if not tag:
-                    features = self._get_features(i, word, context, prev, prev2)
-                    tag = self.model.predict(features)
-                tokens.append((word, tag))
-                prev2 = prev
-                prev = tag
+            tokens.extend(zip(words, self._decode(words, beam_width)))
         return tokens
 
-    def train(self, sentences, save_loc=None, nr_iter=5):
+    def _decode(self, words, beam_width):
+        if beam_width > 1:
+            return self._beam_tag_words(words, beam_width)
+        return self._tag_words(words)
+
+    def _tag_words(self, words):
+        '''Greedily tag a list of words, returns the list of tags.
+
+        A frozen model is scored from the row ids of ``_SentenceBuffer``, an
+        unfrozen one (e.g. while training) from ``_get_features`` strings.
+        '''
+        known, context = self._resolve(words)
+        if context is None:
+            return known
+        frozen = self.model.frozen
+        if frozen:
+            buffer = self._buffer(words, context)
+            predict_rows = self.model.predict_rows
+        prev, prev2 = self.START
+        tags = []
+        for i, word in enumerate(words):
+            tag = known[i]
+            if not tag:
+                if frozen:
+                    tag = predict_rows(buffer.rows(i, prev, prev2))
+                else:
+                    tag = self.model.predict(self._get_features(i, word, context, prev, prev2))
+            tags.append(tag)
+            prev2 = prev
+            prev = tag
+        return tags
+
+    def _resolve(self, words):
+        '''Tag dictionary fast path, returns (tags, context).
+
+        ``tags`` has the tag of every word the tag dictionary resolves and
+        ``None`` for the others. ``context`` holds the normalized words wrapped
+        in START and END, only the words within two positions of an ambiguous
+        one (the window its features look at) are normalized, the rest stay
+        ``None``. It is ``None`` when every word was resolved.
+        '''
+        tagdict = self.tagdict
+        tags = [tagdict.get(word) or None for word in words]
+        stats = self._stats
+        stats['tokens'] += len(words)
+        ambiguous = [i for i, tag in enumerate(tags) if tag is None]
+        stats['fast_path'] += len(words) - len(ambiguous)
+        if not ambiguous:
+            return tags, None
+        offset = len(self.START)
+        context = self.START + [None] * len(words) + self.END
+        normalize = self._normalize
+        normalized = 0
+        for i in ambiguous:
+            for k in range(max(i - 2, 0), min(i + 3, len(words))):
+                if context[k + offset] is None:
+                    context[k + offset] = normalize(words[k])
+                    normalized += 1
+        stats['normalized'] += normalized
+        return tags, context
+
+    def fast_path_stats(self):
+        '''Return how many tokens were tagged, how many the tag dictionary
+        resolved without any feature work and how many words had to be
+        normalized, along with their ratios to the tagged tokens. Useful to
+        tune the thresholds of ``_make_tagdict`` for throughput.
+        '''
+        stats = dict(self._stats)
+        tokens = stats['tokens']
+        stats['fast_path_ratio'] = float(stats['fast_path']) / tokens if tokens else 0.0
+        stats['normalized_ratio'] = float(stats['normalized']) / tokens if tokens else 0.0
+        return stats
+
+    def reset_fast_path_stats(self):
+        '''Set the ``fast_path_stats`` counters back to zero.'''
+        for name in self._stats:
+            self._stats[name] = 0
+        return None
+
+    def _beam_tag_words(self, words, beam_width):
+        '''Tag a list of words with a beam search, returns the list of tags.
+
+        Hypotheses add up the log-softmax of the scores of their tags, the raw
+        perceptron scores of a greedily trained model are not comparable from
+        one position to the next and made wider beams less accurate. The
+        static rows of a position are looked up once in the sentence buffer
+        and shared by all the hypotheses, only the four tag features differ
+        between them.
+        Hypotheses ending with the same two tags will see the same features
+        from then on, so only the best of them is kept.
+        '''
+        known, context = self._resolve(words)
+        if context is None:
+            return known
+        buffer = self._buffer(words, context)
+        scores_rows = self.model.scores_rows
+        labels = self.model.labels
+        # (score, node) hypotheses, a node being a (tag, previous node) tuple
+        beam = [(0.0, (self.START[0], (self.START[1], None)))]
+        for i, word in enumerate(words):
+            tag = known[i]
+            candidates = []
+            for score, node in beam:
+                if tag:
+                    candidates.append((score, tag, node))
+                    continue
+                label_scores = scores_rows(buffer.rows(i, node[0], node[1][0]))
+                top = max(label_scores)
+                norm = top + math.log(sum([math.exp(label_score - top) for label_score in label_scores]))
+                for label_score, label in heapq.nlargest(beam_width, zip(label_scores, labels)):
+                    candidates.append((score + label_score - norm, label, node))
+            # stable, so ties keep the order of the (score, label) ranking
+            candidates.sort(key=lambda candidate: candidate[0], reverse=True)
+            beam = []
+            seen = set()
+            for score, label, node in candidates:
+                if (label, node[0]) in seen:
+                    continue
+                seen.add((label, node[0]))
+                beam.append((score, (label, node)))
+                if len(beam) == beam_width:
+                    break
+        tags = []
+        node = beam[0][1]
+        for _ in words:
+            tags.append(node[0])
+            node = node[1]
+        return tags[::-1]
+
+    def _buffer(self, words, context):
+        '''Return a new sentence buffer over the template tables of the
+        frozen model, rebuilding the tables when the model was frozen again
+        or replaced. The tables are never changed once built, so they are
+        shared by all the calls of this tagger.
+        '''
+        feat_ids = self.model.feature_ids
+        tables = self._feature_tables
+        if tables is None or tables.feat_ids is not feat_ids:
+            tables = self._feature_tables = _FeatureTables(feat_ids)
+        return _SentenceBuffer(tables, words, context)
+
+    def tag_sents(self, sentences, beam_width=1):
+        '''Tags a list of tokenized sentences, returns a list of [(word, tag)] lists.
+
+        Greedy decoding makes every position depend on the tag before it, so
+        the batch is tagged one sentence at a time, each sentence on its own
+        from the START context. Batching saves the per call overhead only.
+
+        :param sentences: A list of word lists.
+        :param beam_width: Number of hypotheses kept by the decoder, see ``tag``.
+        '''
+        return [list(zip(words, self._decode(words, beam_width))) for words in sentences]
+
+    def tag_batch(self, texts, use_tokens=True, beam_width=1):
+        '''Tags a list of strings, returns a [(word, tag)] list per string.
+
+        Like ``tag`` every string is split in sentences, the sentences of all
+        the strings then go through a single ``tag_sents`` call.
+
+        :param texts: A list of strings.
+        :param use_tokens: Whether to use ``tokenize`` or a plain whitespace split.
+        :param beam_width: Number of hypotheses kept by the decoder, see ``tag``.
+        '''
+        w_split = tokenize if use_tokens else lambda s: s.split()
+        sentences = []
+        counts = []
+        for text in texts:
+            text_sentences = string_utils.split_sentences(text)
+            sentences.extend(w_split(sentence) for sentence in text_sentences)
+            counts.append(len(text_sentences))
+        tagged = iter(self.tag_sents(sentences, beam_width=beam_width))
+        return [[token for _ in range(count) for token in next(tagged)] for count in counts]
+
+    def train(self, sentences, save_loc=None, nr_iter=5, freq_thresh=20, ambiguity_thresh=0.97):
         '''Train a model from sentences, and save it at ``save_loc``. ``nr_iter``
         controls the number of Perceptron training iterations.
 
         :param sentences: A list of (words, tags) tuples.
         :param save_loc: If not ``None``, saves a pickled model in this location.
         :param nr_iter: Number of training iterations.
+        :param freq_thresh: Tag dictionary threshold, see ``_make_tagdict``.
+        :param ambiguity_thresh: Tag dictionary threshold, see ``_make_tagdict``.
         '''
-        self._make_tagdict(sentences)
+        self._make_tagdict(sentences, freq_thresh=freq_thresh, ambiguity_thresh=ambiguity_thresh)
         self.model.classes = self.classes
         for iter_ in range(nr_iter):
             c = 0
@@ -204,6 +692,7 @@ class PerceptronTagger():
             random.shuffle(sentences)
             logging.info("Iter {0}: {1}/{2}={3}".format(iter_, c, n, _pc(c, n)))
         self.model.average_weights()
+        self.model.freeze()
         # Pickle as a binary file
         if save_loc is not None:
             pickle.dump((self.model.weights, self.tagdict, self.classes),
@@ -219,6 +708,117 @@ class PerceptronTagger():
             raise Exception(msg)
         self.model.weights, self.tagdict, self.classes = w_td_c
         self.model.classes = self.classes
+        self.model.freeze()
+        return None
+
+    def save_binary(self, loc):
+        '''Save the frozen model in the memory-mappable binary format of
+        ``utils.binmodel``.
+        '''
+        features, labels, matrix = self.model.dump_frozen()
+        typecode = matrix.typecode if isinstance(matrix, array) else matrix.format
+        sections = [('features', features), ('labels', labels), ('classes', sorted(self.classes)),
+                    ('matrix', array(typecode, matrix))]
+        if self.model.scales is not None:
+            sections.append(('scales', array('d', self.model.scales)))
+        binmodel.write(loc, sections + binmodel.mapping_sections('tagdict', self.tagdict))
+        return None
+
+    def load_binary(self, loc):
+        '''Load a binary model. The score matrix stays in the mapped file, so
+        loading is close to instant and processes share its pages. Binary
+        models can only tag, training needs the pickled weights.
+        '''
+        try:
+            data = binmodel.BinaryModel(loc)
+        except IOError:
+            msg = ("Missing {0} file.".format(loc))
+            raise Exception(msg)
+        scales = data.array('scales') if 'scales' in data else None
+        self.model.load_frozen(data.strings('features'), data.strings('labels'), data.array('matrix'), scales)
+        self.tagdict = data.mapping('tagdict')
+        self.classes = set(data.strings('classes'))
+        return None
+
+    def evaluate(self, sentences):
+        '''Return the tagging accuracy over gold (words, tags) tuples.
+
+        The ``fast_path_stats`` counters are left as they were, they only
+        count the tokens tagged for the caller.
+        '''
+        sentences = list(sentences)
+        stats = dict(self._stats)
+        try:
+            tagged_sents = self.tag_sents([words for words, _ in sentences])
+        finally:
+            self._stats.update(stats)
+        c = 0
+        n = 0
+        for (words, tags), tagged in zip(sentences, tagged_sents):
+            c += sum(tag == guess for tag, (_, guess) in zip(tags, tagged))
+            n += len(tags)
+        return float(c) / n if n else 0.0
+
+    def feature_counts(self, sentences):
+        '''Count how many times every feature fires over gold (words, tags)
+        tuples, the gold tags standing in for the predicted ``prev``/``prev2``.
+        '''
+        counts = defaultdict(int)
+        for words, tags in sentences:
+            context = self.START + [self._normalize(w) for w in words] + self.END
+            prev, prev2 = self.START
+            for i, word in enumerate(words):
+                if not self.tagdict.get(word):
+                    for feat in self._get_features(i, word, context, prev, prev2):
+                        counts[feat] += 1
+                prev2 = prev
+                prev = tags[i]
+        return counts
+
+    def compress(self, threshold=0.0, min_count=1, bits=8, sentences=None, heldout=None):
+        '''Prune and quantize the model in place, see ``AveragedPerceptron.compress``.
+
+        :param threshold: Weights with a smaller absolute value are dropped.
+        :param min_count: Features firing fewer times over ``sentences`` are dropped.
+        :param bits: 8 or 16, size of the stored weights.
+        :param sentences: (words, tags) tuples used to count feature firings,
+            usually the training corpus. No feature is dropped for being rare if ``None``.
+        :param heldout: (words, tags) tuples to measure the accuracy before and
+            after, e.g. a slice of ``treebank.read_treebank('penn_treebank')``.
+        :return: a dict with the feature count and matrix bytes before and
+            after, plus the accuracies and their delta when ``heldout`` is given.
+        '''
+        heldout = list(heldout) if heldout is not None else None
+        counts = self.feature_counts(sentences) if sentences is not None else None
+        features, _, matrix = self.model.dump_frozen()
+        report = {'features_before': len(features), 'bytes_before': len(matrix) * matrix.itemsize}
+        if heldout is not None:
+            report['accuracy_before'] = self.evaluate(heldout)
+        self.model.compress(threshold=threshold, counts=counts, min_count=min_count, bits=bits)
+        features, _, matrix = self.model.dump_frozen()
+        report['features_after'] = len(features)
+        report['bytes_after'] = len(matrix) * matrix.itemsize
+        if heldout is not None:
+            report['accuracy_after'] = self.evaluate(heldout)
+            report['accuracy_delta'] = report['accuracy_after'] - report['accuracy_before']
+        logging.info("Compressed model: {0}".format(report))
+        return report
+
+    def cache_info(self):
+        '''Return the hit/miss counters of the per-word caches, keyed by
+        method name, or ``None`` if caching is disabled.
+        '''
+        if not self.cache_size:
+            return None
+        return dict((name, getattr(self, name).cache_info())
+                    for name in ('_normalize', '_word_features', '_context_features'))
+
+    def cache_clear(self):
+        '''Empty the per-word caches and reset their counters.'''
+        if self.cache_size:
+            self._normalize.cache_clear()
+            self._word_features.cache_clear()
+            self._context_features.cache_clear()
         return None
 
     def _normalize(self, word):
@@ -239,6 +839,18 @@ class PerceptronTagger():
         else:
             return word.lower()
 
+    def _word_features(self, word):
+        '''Return the ``i suffix`` and ``i pref1`` feature strings of a raw word.'''
+        return 'i suffix ' + word[-3:], 'i pref1 ' + word[0]
+
+    def _context_features(self, word):
+        '''Return the feature strings a normalized context word can produce,
+        as (i word, i-1 word, i-1 suffix, i-2 word, i+1 word, i+1 suffix, i+2 word).
+        '''
+        suffix = word[-3:]
+        return ('i word ' + word, 'i-1 word ' + word, 'i-1 suffix ' + suffix, 'i-2 word ' + word,
+                'i+1 word ' + word, 'i+1 suffix ' + suffix, 'i+2 word ' + word)
+
     def _get_features(self, i, word, context, prev, prev2):
         '''Map tokens into a feature representation, implemented as a
         {hashable: float} dict. If the features change, a new model must be
@@ -249,32 +861,40 @@ class PerceptronTagger():
 
         i += len(self.START)
         features = defaultdict(int)
+        suffix, pref1 = self._word_features(word)
+        current = self._context_features(context[i])
+        before = self._context_features(context[i-1])
+        after = self._context_features(context[i+1])
         # It's useful to have a constant feature, which acts sort of like a prior
         add('bias')
-        add('i suffix', word[-3:])
-        add('i pref1', word[0])
+        features[suffix] += 1
+        features[pref1] += 1
         add('i-1 tag', prev)
         add('i-2 tag', prev2)
         add('i tag+i-2 tag', prev, prev2)
-        add('i word', context[i])
+        features[current[0]] += 1
         add('i-1 tag+i word', prev, context[i])
-        add('i-1 word', context[i-1])
-        add('i-1 suffix', context[i-1][-3:])
-        add('i-2 word', context[i-2])
-        add('i+1 word', context[i+1])
-        add('i+1 suffix', context[i+1][-3:])
-        add('i+2 word', context[i+2])
+        features[before[1]] += 1
+        features[before[2]] += 1
+        features[self._context_features(context[i-2])[3]] += 1
+        features[after[4]] += 1
+        features[after[5]] += 1
+        features[self._context_features(context[i+2])[6]] += 1
         return features
 
-    def _make_tagdict(self, sentences):
-        '''Make a tag dictionary for single-tag words.'''
+    def _make_tagdict(self, sentences, freq_thresh=20, ambiguity_thresh=0.97):
+        '''Make a tag dictionary for single-tag words.
+
+        :param freq_thresh: Minimum number of occurrences of a word.
+        :param ambiguity_thresh: Minimum share of its occurrences the most
+            frequent tag of a word must have. Lower thresholds send more words
+            through the fast path of ``fast_path_stats``, at some accuracy cost.
+        '''
         counts = defaultdict(lambda: defaultdict(int))
         for words, tags in sentences:
             for word, tag in zip(words, tags):
                 counts[word][tag] += 1
                 self.classes.add(tag)
-        freq_thresh = 20
-        ambiguity_thresh = 0.97
         for word, tag_freqs in counts.items():
             tag, mode = max(tag_freqs.items(), key=lambda item: item[1])
             n = sum(tag_freqs.values())
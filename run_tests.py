@@ -21,15 +21,14 @@ def command_interface():
 
     start = time.time()
     classifier = NaiveBayesTextClassifier()
-    with open("test.tsv") as tsvfile:
-        reader = csv.DictReader(tsvfile, dialect='excel-tab')
-        training_data = list(reader)
     sentences = list()
     classes = list()
-    for data in training_data:
-        print(data)
-        sentences.append(su.pre_process_sentence(data['sentence']).split())
-        classes.append(data['class'])
+    with open("test.tsv") as tsvfile:
+        reader = csv.DictReader(tsvfile, dialect='excel-tab')
+        for data in reader:
+            print(data)
+            sentences.append(su.pre_process_sentence(data['sentence']).split())
+            classes.append(data['class'])
     classifier.train(sentences,classes)
     end = time.time()
 
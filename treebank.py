@@ -0,0 +1,170 @@
+#
+# Reader for the bundled penn_treebank file, one sentence per line written as
+# space separated word|TAG tokens (the format pipeline.format_tagged writes),
+# and an on-disk feature cache for training on it again and again.
+#
+# The cache is a utils.binmodel file holding, for every token, the ids of its
+# raw word, normalized word, gold tag and of the strings of its static
+# features, the ones that don't depend on the tags predicted before it:
+#   bias, i suffix, i pref1, i word, i-1 word, i-1 suffix, i-2 word,
+#   i+1 word, i+1 suffix, i+2 word
+# so PerceptronTrainer.train_cached only has to build the four tag features
+# per token, the normalization and the rest of the string work is done once.
+#
+
+import io
+
+from array import array
+from pos_tagger import PerceptronTagger
+from utils import binmodel
+
+STATIC_TEMPLATES = ['bias', 'i suffix', 'i pref1', 'i word', 'i-1 word', 'i-1 suffix', 'i-2 word',
+                    'i+1 word', 'i+1 suffix', 'i+2 word']
+
+
+def read_treebank(path, encoding='utf-8'):
+    """
+    Lazily reads a word|TAG corpus file
+    :param path: path of the file to read
+    :param encoding: encoding of the file
+    :return: a generator of (words, tags) tuples, one per non empty line
+    """
+    with io.open(path, encoding=encoding) as handle:
+        for line in handle:
+            tokens = [token.rsplit('|', 1) for token in line.split()]
+            if tokens:
+                yield [word for word, _ in tokens], [tag for _, tag in tokens]
+
+
+def static_features(tagger, words, context):
+    """
+    Static feature strings of every word of a sentence, in STATIC_TEMPLATES order
+    :param tagger: PerceptronTagger whose feature functions are used
+    :param words: the raw words of the sentence
+    :param context: the normalized words wrapped in tagger.START and tagger.END
+    :return: a list with a tuple of feature strings per word
+    """
+    offset = len(tagger.START)
+    rows = []
+    for i, word in enumerate(words):
+        i += offset
+        suffix, pref1 = tagger._word_features(word)
+        current = tagger._context_features(context[i])
+        before = tagger._context_features(context[i - 1])
+        after = tagger._context_features(context[i + 1])
+        rows.append(('bias', suffix, pref1, current[0], before[1], before[2],
+                     tagger._context_features(context[i - 2])[3], after[4], after[5],
+                     tagger._context_features(context[i + 2])[6]))
+    return rows
+
+
+class _Table:
+
+    # Interns strings to consecutive ids
+
+    def __init__(self):
+        self.ids = {}
+
+    def id(self, text):
+        i = self.ids.get(text)
+        if i is None:
+            i = self.ids[text] = len(self.ids)
+        return i
+
+    def strings(self):
+        return list(self.ids)
+
+
+class FeatureCache:
+
+    def __init__(self, path):
+        """
+        Opens a cache written by FeatureCache.build, the string tables are decoded once
+        :param path: path of the cache file
+        """
+        self.path = path
+        data = binmodel.BinaryModel(path)
+        if 'templates' not in data or data.strings('templates') != STATIC_TEMPLATES:
+            raise ValueError("%s was built for other features, build the cache again" % path)
+        self.features = data.strings('features')
+        self.words = data.strings('words')
+        self.norms = data.strings('norms')
+        self.tags = data.strings('tags')
+        self._offsets = data.array('sentences')
+        self._word = data.array('word')
+        self._norm = data.array('norm')
+        self._tag = data.array('tag')
+        self._static = data.array('static')
+
+    @classmethod
+    def build(cls, path, sentences, tagger=None):
+        """
+        Computes the static features of a corpus and writes them to a cache file
+        :param path: path of the cache file to write
+        :param sentences: iterable of (words, tags) tuples, e.g. read_treebank(...)
+        :param tagger: PerceptronTagger providing the normalization and feature functions, an untrained one by default
+        :return: the FeatureCache of the new file
+        """
+        if tagger is None:
+            tagger = PerceptronTagger(load=False)
+        features, words, norms, tags = _Table(), _Table(), _Table(), _Table()
+        offsets = array('Q', [0])
+        word_ids, norm_ids, tag_ids, static_ids = array('I'), array('I'), array('I'), array('I')
+        for sent_words, sent_tags in sentences:
+            normalized = [tagger._normalize(word) for word in sent_words]
+            context = tagger.START + normalized + tagger.END
+            for word, norm, tag, row in zip(sent_words, normalized, sent_tags,
+                                            static_features(tagger, sent_words, context)):
+                word_ids.append(words.id(word))
+                norm_ids.append(norms.id(norm))
+                tag_ids.append(tags.id(tag))
+                static_ids.extend([features.id(feature) for feature in row])
+            offsets.append(len(word_ids))
+        binmodel.write(path, [('templates', STATIC_TEMPLATES), ('features', features.strings()),
+                              ('words', words.strings()), ('norms', norms.strings()), ('tags', tags.strings()),
+                              ('sentences', offsets), ('word', word_ids), ('norm', norm_ids), ('tag', tag_ids),
+                              ('static', static_ids)])
+        return cls(path)
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def sentence(self, s):
+        """
+        :param s: index of the sentence
+        :return: the (words, tags) tuple of the sentence
+        """
+        start, end = self._offsets[s], self._offsets[s + 1]
+        words, tags = self.words, self.tags
+        return [words[i] for i in self._word[start:end]], [tags[i] for i in self._tag[start:end]]
+
+    def sentences(self):
+        """
+        :return: a generator of the (words, tags) tuples of every sentence
+        """
+        for s in range(len(self)):
+            yield self.sentence(s)
+
+    def token_ids(self, s):
+        """
+        Everything training needs about a sentence, the static features left as ids into self.features
+        :param s: index of the sentence
+        :return: (words, tags, normalized words, static feature id rows) of the sentence
+        """
+        start, end = self._offsets[s], self._offsets[s + 1]
+        width = len(STATIC_TEMPLATES)
+        static = self._static[start * width:end * width]
+        words, tags = self.sentence(s)
+        norms = self.norms
+        return (words, tags, [norms[i] for i in self._norm[start:end]],
+                [static[k:k + width] for k in range(0, len(static), width)])
+
+    def token_features(self, s):
+        """
+        Same as token_ids, with the static feature strings
+        :param s: index of the sentence
+        :return: (words, tags, normalized words, static feature lists) of the sentence
+        """
+        words, tags, norms, static = self.token_ids(s)
+        features = self.features
+        return words, tags, norms, [[features[i] for i in row] for row in static]
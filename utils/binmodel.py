@@ -0,0 +1,193 @@
+#
+# Compact binary container used to store the tagger and Morphy tables without pickle.
+#
+# A file is a small header followed by named sections, every section is either
+# a string table (NUL separated utf-8 text plus an offsets array) or a raw
+# numeric array. Files are opened with mmap, numeric sections are handed out as
+# zero copy memoryviews so loading is close to instant and processes reading the
+# same file share its pages through the OS page cache.
+#
+# Layout (native byte order, recorded in the header):
+#   magic (8 bytes) | byte order (1 byte) | padding (3 bytes) | section count (uint32)
+#   section entries: name (32 bytes, NUL padded) | kind (1 byte) | padding (7 bytes)
+#                    | offset (uint64) | size in bytes (uint64) | item count (uint64)
+#   section data, each one aligned to 8 bytes
+# String tables take two entries: '<name>' holds the text and '<name>.offsets'
+# the uint64 byte offset of every string (count + 1 values).
+# Mappings are two string tables, '<name>.keys' sorted by their utf-8 bytes and
+# '<name>.values' in the same order, so BinaryModel.lookup can bisect the keys
+# inside the mapped file without decoding the table.
+#
+
+import mmap
+import struct
+import sys
+
+from array import array
+
+MAGIC = b'NLPUBIN1'
+_HEADER = struct.Struct('=8sc3xI')
+_NAME_SIZE = 32
+_ENTRY = struct.Struct('=%dsc7xQQQ' % _NAME_SIZE)
+_STRINGS = b's'
+_ALIGN = 8
+
+
+def _padding(size):
+    return (-size) % _ALIGN
+
+
+def write(path, sections):
+    """
+    Writes a binary model file
+    :param path: path of the file to write
+    :param sections: list of (name, value) tuples, value being either a list of strings or an array.array. Names
+        can take up to 32 utf-8 bytes, the '.offsets' suffix of string tables included
+    :return: nothing
+    """
+    entries = []
+    for name, value in sections:
+        if isinstance(value, array):
+            entries.append((name, value.typecode.encode('ascii'), value.tobytes(), len(value)))
+            continue
+        if any('\0' in text for text in value):
+            raise ValueError("Strings in section %s can't contain NUL characters" % name)
+        encoded = [text.encode('utf-8') for text in value]
+        offsets = array('Q', [0])
+        for text in encoded:
+            # every string is followed by its NUL separator
+            offsets.append(offsets[-1] + len(text) + 1)
+        entries.append((name, _STRINGS, b''.join(text + b'\0' for text in encoded), len(encoded)))
+        entries.append((name + '.offsets', b'Q', offsets.tobytes(), len(offsets)))
+    for name, kind, data, count in entries:
+        # longer names would be silently cut by the fixed size name field
+        if len(name.encode('utf-8')) > _NAME_SIZE:
+            raise ValueError("Section name %s is longer than %d bytes" % (name, _NAME_SIZE))
+
+    offset = _HEADER.size + _ENTRY.size * len(entries)
+    offset += _padding(offset)
+    with open(path, 'wb') as handle:
+        handle.write(_HEADER.pack(MAGIC, sys.byteorder[0].encode('ascii'), len(entries)))
+        for name, kind, data, count in entries:
+            handle.write(_ENTRY.pack(name.encode('utf-8'), kind, offset, len(data), count))
+            offset += len(data) + _padding(len(data))
+        handle.write(b'\0' * _padding(handle.tell()))
+        for name, kind, data, count in entries:
+            handle.write(data)
+            handle.write(b'\0' * _padding(len(data)))
+
+
+def mapping_sections(name, mapping):
+    """
+    Sections storing a str to str dict, read back with BinaryModel.mapping or BinaryModel.lookup
+    """
+    # utf-8 byte order is code point order, the same order str comparison uses
+    keys = sorted(mapping)
+    return [(name + '.keys', keys), (name + '.values', [mapping[key] for key in keys]),
+            (name + '.sorted', array('B'))]
+
+
+class BinaryModel:
+
+    def __init__(self, path):
+        with open(path, 'rb') as handle:
+            self._map = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, order, count = _HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise ValueError("%s is not a binary model file" % path)
+        self._swapped = order != sys.byteorder[0].encode('ascii')
+        self._sections = {}
+        # (data offset, offsets array) of the keys and values of the mappings used by lookup
+        self._mappings = {}
+        for i in range(count):
+            name, kind, offset, size, items = _ENTRY.unpack_from(self._map, _HEADER.size + i * _ENTRY.size)
+            self._sections[name.rstrip(b'\0').decode('utf-8')] = (kind, offset, size, items)
+
+    def __contains__(self, name):
+        return name in self._sections
+
+    def array(self, name):
+        """
+        Returns a numeric section, as a zero copy memoryview over the mapped file when possible
+        :param name: name of the section
+        :return: a memoryview (or an array.array if the file was written with another byte order)
+        """
+        kind, offset, size, items = self._sections[name]
+        typecode = kind.decode('ascii')
+        if self._swapped:
+            values = array(typecode)
+            values.frombytes(self._map[offset:offset + size])
+            values.byteswap()
+            return values
+        return memoryview(self._map)[offset:offset + size].cast(typecode)
+
+    def strings(self, name):
+        """
+        Decodes a whole string table
+        :param name: name of the section
+        :return: list of strings
+        """
+        kind, offset, size, items = self._sections[name]
+        if not items:
+            return []
+        # drop the trailing separator before splitting
+        return self._map[offset:offset + size - 1].decode('utf-8').split('\0')
+
+    def mapping(self, name):
+        """
+        Builds a dict out of the '<name>.keys' and '<name>.values' string tables
+        """
+        return dict(zip(self.strings(name + '.keys'), self.strings(name + '.values')))
+
+    def lookup(self, name, key, default=None):
+        """
+        Looks a key of a mapping up straight in the mapped file, bisecting its sorted keys
+        :param name: name of the mapping
+        :param key: the key to look for
+        :param default: returned when key isn't in the mapping
+        :return: the value of key
+        """
+        tables = self._mappings.get(name)
+        if tables is None:
+            if name + '.sorted' not in self._sections:
+                raise ValueError("mapping %s has unsorted keys, write the file again" % name)
+            tables = self._mappings[name] = tuple((self._sections[table][1], self.array(table + '.offsets'))
+                                                  for table in (name + '.keys', name + '.values'))
+        (key_start, key_offsets), (value_start, value_offsets) = tables
+        data = self._map
+        target = key.encode('utf-8')
+        lo, hi = 0, len(key_offsets) - 1
+        while lo < hi:
+            mid = (lo + hi) // 2
+            probe = data[key_start + key_offsets[mid]:key_start + key_offsets[mid + 1] - 1]
+            if probe < target:
+                lo = mid + 1
+            elif probe > target:
+                hi = mid
+            else:
+                return data[value_start + value_offsets[mid]:value_start + value_offsets[mid + 1] - 1].decode('utf-8')
+        return default
+
+
+class MappedDict:
+
+    # Read only dict like view of a BinaryModel mapping, the data stays in the mapped file
+
+    def __init__(self, model, name):
+        self.model = model
+        self.name = name
+
+    def get(self, key, default=None):
+        return self.model.lookup(self.name, key, default)
+
+    def __getitem__(self, key):
+        value = self.model.lookup(self.name, key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return self.model.lookup(self.name, key, _MISSING) is not _MISSING
+
+
+_MISSING = object()
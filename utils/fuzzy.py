@@ -0,0 +1,106 @@
+#
+# Indexed fuzzy matching of a text against a big list of phrases.
+# Phrases are indexed by their character n-grams (see string_utils.ngram), a query only
+# looks at the phrases sharing n-grams with it, keeps the ones sharing the most and
+# scores those with calculate_string_distance, so it doesn't have to compare the query
+# against every phrase with a SequenceMatcher.
+#
+
+import heapq
+
+from collections import Counter
+from difflib import SequenceMatcher
+from utils.string_utils import ngram
+
+
+class FuzzyIndex:
+
+    def __init__(self, phrases=(), n=3):
+        """
+        :param phrases: iterable of phrases to index
+        :param n: size of the character n-grams used to find candidates
+        """
+        self.n = n
+        self.phrases = []
+        # lowercased phrases, what calculate_string_distance compares
+        self._lowered = []
+        # number of distinct n-grams of every phrase
+        self._sizes = []
+        # n-gram -> ids of the phrases containing it
+        self.postings = {}
+        for phrase in phrases:
+            self.add(phrase)
+
+    def __len__(self):
+        return len(self.phrases)
+
+    def _grams(self, text):
+        """
+        Distinct n-grams of text, padded with spaces so word starts and ends get their own n-grams. Texts too
+        short to have any are represented by their whole normalized form
+        """
+        padded = ' ' + text + ' '
+        grams = set(ngram(self.n, padded))
+        if not grams:
+            grams.add(''.join(ngram(1, padded)))
+        return grams
+
+    def add(self, phrase):
+        """
+        Adds a phrase to the index
+        :param phrase: the phrase to add
+        :return: the id of the phrase
+        """
+        phrase_id = len(self.phrases)
+        grams = self._grams(phrase)
+        self.phrases.append(phrase)
+        self._lowered.append(phrase.lower())
+        self._sizes.append(len(grams))
+        for gram in grams:
+            self.postings.setdefault(gram, []).append(phrase_id)
+        return phrase_id
+
+    def search(self, query, k=5, candidates=50, max_postings=1000):
+        """
+        Finds the phrases most similar to query
+        :param query: the text to look for
+        :param k: number of results to return
+        :param candidates: number of phrases, picked by their share of n-grams with the query, that get an exact
+            score, more candidates means slower but more accurate results
+        :param max_postings: n-grams found in more phrases than this are left out of the candidate search once the
+            three rarest n-grams of the query have been used
+        :return: a list of up to k (phrase, score) tuples sorted by descending score, the score being the same
+            ratio calculate_string_distance gives
+        """
+        if k <= 0:
+            return []
+        grams = self._grams(query)
+        # rarest n-grams first, the very common ones say little about similarity and cost the most to count, they
+        # are only used when the query has no rarer ones to go on
+        lists = sorted(filter(None, map(self.postings.get, grams)), key=len)
+        shared = Counter()
+        for i, ids in enumerate(lists):
+            if i >= 3 and len(ids) > max_postings:
+                break
+            shared.update(ids)
+        if not shared:
+            return []
+        # a wide first cut on the raw shared counts, then the dice coefficient to balance out phrase length
+        pool = shared.most_common(candidates * 4)
+        size = len(grams)
+        sizes = self._sizes
+        pool = heapq.nlargest(candidates, pool, key=lambda item: (2.0 * item[1] / (size + sizes[item[0]]), -item[0]))
+
+        lowered_query = query.lower()
+        best = []
+        for phrase_id, _ in pool:
+            matcher = SequenceMatcher(None, lowered_query, self._lowered[phrase_id])
+            # quick_ratio is an upper bound of ratio, skip candidates that can't make it into the results
+            if len(best) == k and matcher.quick_ratio() < best[0][0]:
+                continue
+            item = (matcher.ratio(), -phrase_id)
+            if len(best) < k:
+                heapq.heappush(best, item)
+            elif item > best[0]:
+                heapq.heapreplace(best, item)
+        return [(self.phrases[-negated_id], score) for score, negated_id in sorted(best, reverse=True)]
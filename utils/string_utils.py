@@ -127,6 +127,31 @@ _ENGLISH_STOPWORDS = ['i', 'me', 'my', 'myself', 'we', 'our', 'ours', 'ourselves
 
 
 _STOPWORDS_REGEX = re.compile(r'(?:^|(?<= ))('+'|'.join(_ENGLISH_STOPWORDS)+')(?:(?= )|$)')
+_PUNC_REGEX = re.compile('[{0}]'.format(re.escape(string.punctuation)))
+# Abbreviations (lowercased, without their final period) that don't end a sentence, mostly the ones found in the
+# penn_treebank file: titles and company suffixes
+_ABBREVIATIONS = frozenset([
+    'mr', 'mrs', 'ms', 'dr', 'prof', 'rep', 'sen', 'gov', 'gen', 'col', 'lt', 'sgt', 'capt', 'rev', 'st', 'jr', 'sr',
+    'messrs', 'corp', 'inc', 'cos', 'ltd', 'pty', 'bros', 'vs', 'etc', 'dept', 'approx', 'mt'])
+# Abbreviations matched with their case, the ones that are also common words in lowercase ("ill", "miss", "wash"):
+# months, US states and a few more
+_CASED_ABBREVIATIONS = frozenset([
+    'Co', 'Jan', 'Feb', 'Mar', 'Apr', 'Jun', 'Jul', 'Aug', 'Sep', 'Sept', 'Oct', 'Nov', 'Dec', 'Ala', 'Ariz', 'Ark',
+    'Calif', 'Colo', 'Conn', 'Del', 'Fla', 'Ga', 'Ill', 'Ind', 'Kan', 'Ky', 'La', 'Mass', 'Md', 'Mich', 'Minn',
+    'Miss', 'Mo', 'Mont', 'Neb', 'Nev', 'Okla', 'Ore', 'Pa', 'Tenn', 'Tex', 'Va', 'Vt', 'Wash', 'Wis', 'Wyo', 'Fig',
+    'Ave'])
+# Abbreviations only when a number follows them, as in "No. 1"
+_NUMBER_ABBREVIATIONS = frozenset(['no', 'nos'])
+# Initials and dotted abbreviations such as N.V., U.S. or p.m.
+_DOTTED_REGEX = re.compile(r'[A-Za-z]\.[A-Za-z]')
+# Words that usually open a sentence, an abbreviation followed by one of them ends its sentence
+_SENTENCE_OPENERS = frozenset([
+    'the', 'a', 'an', 'in', 'it', 'its', 'he', 'she', 'they', 'we', 'i', 'his', 'her', 'their', 'this', 'that',
+    'these', 'those', 'there', 'but', 'and', 'as', 'at', 'for', 'if', 'when', 'while', 'however', 'meanwhile', 'also',
+    'yet', 'so', 'some', 'many', 'most', 'on', 'after', 'although', 'still', 'separately'])
+_SENTENCE_ENDS = '.!?'
+_CLOSERS = '\'")]}\u2019\u201d'
+_OPENERS = '\'"([{`\u2018\u201c'
 
 
 def _contractions_replace(match):
@@ -146,14 +171,17 @@ def expand_contractions(text, regex=_CONTRACTIONS_REGEX):
     return regex.sub(_contractions_replace, text)
 
 
-def remove_stopwords(text, regex=_STOPWORDS_REGEX):
+def remove_stopwords(text, regex=None):
     """
     Removes the stopwords found in the text
     :param text: the text string that we'll be removing the stopwords from
-    :param regex: regex to be used to find the stopwords in the text, should be left to default unless you want to use
-        another set of stopwords
+    :param regex: regex to be used to find the stopwords in the text, by default the english stopwords are looked up
+        word by word with a WordFilter, which gives the same result as _STOPWORDS_REGEX. For another set of
+        stopwords a WordFilter of them is usually the better choice
     :return: the text without the stopwords
     """
+    if regex is None:
+        return _STOPWORDS_FILTER(text)
     return regex.sub('',text)
 
 
@@ -165,7 +193,7 @@ def strip_punc(s, all=False):
         the ends of the string.
     """
     if all:
-        return re.compile('[{0}]'.format(re.escape(string.punctuation))).sub('', s.strip())
+        return _PUNC_REGEX.sub('', s.strip())
     else:
         return s.strip().strip(string.punctuation)
 
@@ -180,6 +208,67 @@ def calculate_string_distance(first, final):
     return SequenceMatcher(None, first.lower(), final.lower()).ratio()
 
 
+def _is_abbreviation(stripped, previous, following):
+    """
+    Whether a token ending with a period, closing quotes and brackets already stripped, is an abbreviation or an
+    initial. A period written as its own token is checked along with the previous token, so already tokenized text
+    like "Mrs . Yeargin" is handled too. following is the next token, "No." only abbreviates before a number
+    """
+    if stripped[-1] != '.' or stripped.endswith('..'):
+        return False
+    word = stripped[:-1].lstrip(_OPENERS) or previous
+    if len(word) == 1 and word.isalpha():
+        return True
+    if word.lower() in _NUMBER_ABBREVIATIONS:
+        return following.lstrip(_OPENERS)[:1].isdigit()
+    return (word.lower() in _ABBREVIATIONS or word in _CASED_ABBREVIATIONS or
+            _DOTTED_REGEX.search(word) is not None)
+
+
+def _starts_sentence(token):
+    """
+    Whether a token can be the first one of a sentence, starting with an uppercase letter or a digit after any opening
+    quotes or brackets
+    """
+    first = token.lstrip(_OPENERS)
+    return not first or first[0].isupper() or first[0].isdigit()
+
+
+def split_sentences(text):
+    """
+    Splits a text into sentences. Every line break ends a sentence, inside a line a sentence ends after a token ending
+    with . ! or ? (closing quotes and brackets included) when the next token looks like the start of a new one.
+    Abbreviations like Mr., Nov. or N.V. and initials only end a sentence when followed by a common sentence opener
+    such as "The" or "He"
+    :param text: the text to split
+    :return: list of sentences, each one with its tokens separated by single spaces
+    """
+    sentences = []
+    for line in text.splitlines():
+        tokens = line.split()
+        start = 0
+        i = 0
+        while i < len(tokens):
+            token = tokens[i]
+            if token[-1] in _SENTENCE_ENDS or token[-1] in _CLOSERS:
+                stripped = token.rstrip(_CLOSERS)
+                if stripped and stripped[-1] in _SENTENCE_ENDS:
+                    # closing quotes written as separate tokens belong to the sentence they close
+                    j = i + 1
+                    while j < len(tokens) and not tokens[j].strip(_CLOSERS):
+                        j += 1
+                    if j == len(tokens) or (_starts_sentence(tokens[j]) and (
+                            tokens[j].lstrip(_OPENERS).lower() in _SENTENCE_OPENERS or
+                            not _is_abbreviation(stripped, tokens[i - 1] if i > start else '', tokens[j]))):
+                        sentences.append(' '.join(tokens[start:j]))
+                        start = i = j
+                        continue
+            i += 1
+        if start < len(tokens):
+            sentences.append(' '.join(tokens[start:]))
+    return sentences
+
+
 def normalize(line, accepted_chars='abcdefghijklmnopqrstuvwxyz '):
     """
     Return only the subset of chars from accepted_chars.
@@ -189,11 +278,90 @@ def normalize(line, accepted_chars='abcdefghijklmnopqrstuvwxyz '):
     return [c.lower() for c in line if c.lower() in accepted_chars]
 
 
+class _AcceptedCharsTable(dict):
+    """
+    str.translate table mapping every char to its lowercase form when that is in accepted_chars and dropping it
+    otherwise, the same filter normalize applies. Chars are added to the table the first time they are seen so the
+    following lookups stay inside str.translate
+    """
+
+    def __init__(self, accepted_chars):
+        dict.__init__(self)
+        self.accepted_chars = accepted_chars
+
+    def __missing__(self, code):
+        lowered = chr(code).lower()
+        value = lowered if lowered in self.accepted_chars else None
+        self[code] = value
+        return value
+
+
+_TRANSLATE_TABLES = {}
+
+# rolling hash parameters used by ngrams with hashed=True
+_HASH_BASE = 257
+_HASH_MOD = (1 << 61) - 1
+
+
+def normalize_text(line, accepted_chars='abcdefghijklmnopqrstuvwxyz '):
+    """
+    Same as normalize but returns a string, the filtering is done by str.translate with a cached table
+    :param line: the text to normalize
+    :param accepted_chars: chars to keep, after lowercasing
+    :return: the normalized text
+    """
+    table = _TRANSLATE_TABLES.get(accepted_chars)
+    if table is None:
+        table = _TRANSLATE_TABLES[accepted_chars] = _AcceptedCharsTable(accepted_chars)
+    return line.translate(table)
+
+
+def ngrams(n, line, hashed=False, normalized=False):
+    """
+    Fast version of ngram returning a list, n-grams are sliced out of the normalized string instead of joining
+    lists of chars
+    :param n: size of the n-grams
+    :param line: the text to get the n-grams from
+    :param hashed: return an integer rolling hash of every n-gram instead of the n-gram itself
+    :param normalized: line was already normalized with normalize_text, skip that step
+    :return: a list of n-gram strings, or of their hashes
+    """
+    text = line if normalized else normalize_text(line)
+    count = len(text) - n + 1
+    if not hashed:
+        return [text[start:start + n] for start in range(count)]
+    if count <= 0:
+        return []
+    if n == 0:
+        return [0] * count
+    # polynomial hash of the first window, then roll it one char at a time
+    codes = [ord(c) for c in text]
+    high = pow(_HASH_BASE, n - 1, _HASH_MOD)
+    value = 0
+    for code in codes[:n]:
+        value = (value * _HASH_BASE + code) % _HASH_MOD
+    hashes = [value]
+    for start in range(1, count):
+        value = ((value - codes[start - 1] * high) * _HASH_BASE + codes[start + n - 1]) % _HASH_MOD
+        hashes.append(value)
+    return hashes
+
+
+def batch_ngrams(n, lines, hashed=False):
+    """
+    Extracts the n-grams of many lines at once
+    :param n: size of the n-grams
+    :param lines: iterable of texts
+    :param hashed: return integer rolling hashes instead of the n-grams
+    :return: a list with the ngrams result of every line
+    """
+    return [ngrams(n, line, hashed=hashed) for line in lines]
+
+
 def ngram(n, l):
     """ Return all n grams from l after normalizing """
-    filtered = normalize(l)
-    for start in range(0, len(filtered) - n + 1):
-        yield ''.join(filtered[start:start + n])
+    for gram in ngrams(n, l):
+        yield gram
 
 
 def pre_process_sentence( sentence):
@@ -208,3 +376,149 @@ def pre_process_sentence( sentence):
     return strip_punc(expanded_sentence)
 
 
+class Normalizer:
+    """
+    Configurable single pass text normalizer. Everything it needs is built once in the constructor, then each call
+    lowercases the text, splits it on whitespace and handles every token in a single scan: contractions are expanded,
+    punctuation stripped and stopwords dropped, returning the tokens directly instead of a new string after every
+    step like pre_process_sentence and remove_stopwords do.
+    """
+
+    def __init__(self, lowercase=True, contractions=None, punctuation='strip', stopwords=None):
+        """
+        :param lowercase: lowercase the text before anything else
+        :param contractions: dict of contractions to expand, defaults to the english contractions used by
+            expand_contractions, pass an empty dict to keep them as they are
+        :param punctuation: 'strip' removes punctuation from both ends of every token, 'remove' removes all of it
+            (like strip_punc with all=True) and None keeps it
+        :param stopwords: iterable of words to drop, None keeps every word
+        """
+        if contractions is None:
+            contractions = _CONTRACTIONS_DICT
+        if punctuation not in ('strip', 'remove', None):
+            raise ValueError("punctuation must be 'strip', 'remove' or None")
+        self.lowercase = lowercase
+        self.punctuation = punctuation
+        if lowercase:
+            contractions = dict((k.lower(), v.lower()) for k, v in contractions.items())
+        self.contractions = dict((k, v.split()) for k, v in contractions.items())
+        self.stopwords = frozenset(w.lower() if lowercase else w for w in stopwords or ())
+        self._remove_table = str.maketrans('', '', string.punctuation)
+
+    def __call__(self, text):
+        """
+        Normalizes text
+        :param text: the text to normalize
+        :return: the list of normalized tokens
+        """
+        contractions = self.contractions
+        stopwords = self.stopwords
+        punctuation = self.punctuation
+        tokens = []
+        for token in (text.lower() if self.lowercase else text).split():
+            expanded = contractions.get(token)
+            if expanded is None and punctuation is not None:
+                token = token.strip(string.punctuation)
+                # a contraction followed by a comma or a full stop
+                expanded = contractions.get(token)
+            for word in expanded or (token,):
+                if punctuation == 'remove':
+                    word = word.translate(self._remove_table)
+                if word and word not in stopwords:
+                    tokens.append(word)
+        return tokens
+
+
+class WordFilter:
+    """
+    Removes whole words found in a set, checking each token with a single hash lookup instead of running a big
+    alternation regex over the text. With the default separator it gives the same result as remove_stopwords does
+    on space separated text, keeping the spaces around the removed words; with separator None the text is split on
+    any whitespace (tabs and newlines included) and the remaining words are joined with single spaces.
+    """
+
+    def __init__(self, words=None, separator=' '):
+        """
+        :param words: iterable of the words to remove, defaults to the english stopwords
+        :param separator: string the text is split on, None to split on any whitespace
+        """
+        self.words = frozenset(_ENGLISH_STOPWORDS if words is None else words)
+        self.separator = separator
+
+    def __call__(self, text):
+        """
+        Removes the words from text
+        :param text: the text to filter
+        :return: the text without the words
+        """
+        words = self.words
+        if self.separator is None:
+            return ' '.join(token for token in text.split() if token not in words)
+        # the stopwords regex lets a word end right before the final newline, only that one
+        newline = '\n' if text.endswith('\n') else ''
+        text = text[:len(text) - len(newline)]
+        return self.separator.join('' if token in words else token for token in text.split(self.separator)) + newline
+
+
+_STOPWORDS_FILTER = WordFilter(_ENGLISH_STOPWORDS)
+
+
+class TrieReplacer:
+    """
+    Replaces phrases found anywhere in a text using a character trie, custom phrase lists don't need a giant regex
+    to be built. Matching follows the regex alternation rules used by expand_contractions: the text is scanned left
+    to right, at each position the phrase listed first among the ones matching there wins and scanning resumes after
+    it. Every position is only walked as deep as the longest phrase, so the time is linear in the text length.
+    """
+
+    def __init__(self, replacements=None):
+        """
+        :param replacements: dict of phrase -> replacement, defaults to the english contractions
+        """
+        if replacements is None:
+            replacements = _CONTRACTIONS_DICT
+        self.root = {}
+        for priority, (phrase, replacement) in enumerate(replacements.items()):
+            if not phrase:
+                raise ValueError("Phrases can't be empty")
+            node = self.root
+            for c in phrase:
+                node = node.setdefault(c, {})
+            # the None key marks the end of a phrase
+            node.setdefault(None, (priority, len(phrase), replacement))
+
+    def __call__(self, text):
+        """
+        Replaces the phrases found in text
+        :param text: the text where the phrases will be replaced
+        :return: the text with the replacements done
+        """
+        root = self.root
+        length = len(text)
+        parts = []
+        last = 0
+        i = 0
+        while i < length:
+            node = root.get(text[i])
+            if node is None:
+                i += 1
+                continue
+            best = node.get(None)
+            j = i + 1
+            while j < length:
+                node = node.get(text[j])
+                if node is None:
+                    break
+                end = node.get(None)
+                if end is not None and (best is None or end < best):
+                    best = end
+                j += 1
+            if best is None:
+                i += 1
+                continue
+            parts.append(text[last:i])
+            parts.append(best[2])
+            i += best[1]
+            last = i
+        parts.append(text[last:])
+        return ''.join(parts)